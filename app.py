@@ -1,6 +1,7 @@
 import sys
+import time
+import multiprocessing
 import traceback
-import uuid
 from datetime import datetime
 from http import HTTPStatus
 
@@ -16,6 +17,10 @@ from botbuilder.schema import Activity, ActivityTypes
 
 from bots import StickyALFASBot, StickyUITHOFBot, StickyADMINBot
 from config import DefaultConfig
+import modules.database as db
+from modules.coordinator import Coordinator
+from modules.role_index import role_index
+import modules.reminders as reminders
 
 
 # Catch-all for errors.
@@ -46,7 +51,14 @@ async def on_error(context: TurnContext, error: Exception):
         await context.send_activity(trace_activity)
 
 CONFIG = DefaultConfig()
-BOTS = BOTS_CHECK = ['ALFAS', 'UITHOF']
+
+# The bots that can be started, by name: (bot class, url path). The app id and password are read from the config
+# as <name>_APP_ID and <name>_APP_PASSWORD, so adding a bot only needs an entry here.
+BOT_REGISTRY = {
+    'ALFAS': (StickyALFASBot, "/api/alfas/messages"),
+    'UITHOF': (StickyUITHOFBot, "/api/uithof/messages"),
+}
+BOTS = BOTS_CHECK = list(BOT_REGISTRY)
 
 if sys.argv[1:]:
     BOTS = sys.argv[1:]
@@ -55,64 +67,114 @@ if sys.argv[1:]:
         BOTS[i] = BOTS[i].upper()
         if BOTS[i] not in BOTS_CHECK:
             print("Wrong arguments. Arguments must only be the name of the bots you want to start. \n\n" \
-                "Example: app.py ALFAS C88.\n\nWhen you use all the bots, no bots have to be specified.\n"
+                f"Example: app.py {' '.join(BOTS_CHECK)}.\n\nWhen you use all the bots, no bots have to be specified.\n"
                 f'The current bots you can choose are: {BOTS_CHECK}\n'\
                 "When no arguments are given, all bots are launched.")
             sys.exit(1)
 
-# Very much python, very much magickery
-ALFAS_BOT = C88_BOT = UITHOF_BOT = None
-for bot in BOTS:
-    locals()[bot + "_SETTINGS"] = BotFrameworkAdapterSettings(eval(f'CONFIG.{bot}_APP_ID'), eval(f'CONFIG.{bot}_APP_PASSWORD'))
-    locals()[bot + "_ADAPTER"] = BotFrameworkAdapter(eval(f'{bot}_SETTINGS'))
-    locals()[bot + "_ADAPTER"].on_turn_error = on_error
-    locals()[bot + "_APP_ID"] = locals()[bot + "_SETTINGS"].app_id if locals()[bot + "_SETTINGS"].app_id else uuid.uuid4()
-    locals()[bot + "_BOT"] = eval(f'Sticky{bot}Bot(CONFIG.{bot}_APP_ID, CONFIG.{bot}_APP_PASSWORD)')
+def create_adapter(app_id, app_password):
+    adapter = BotFrameworkAdapter(BotFrameworkAdapterSettings(app_id, app_password))
+    adapter.on_turn_error = on_error
+    return adapter
+
+STARTUP_TIME = time.monotonic()
+
+# Load all users with their roles once, permission checks are answered from memory after this.
+role_index.load()
+
+# Every incoming activity is routed on the app id of its recipient: app id -> (adapter, bot).
+ROUTES = {}
+RUNNING_BOTS = {}
+for name in BOTS:
+    bot_class, _ = BOT_REGISTRY[name]
+    app_id, app_password = getattr(CONFIG, f'{name}_APP_ID'), getattr(CONFIG, f'{name}_APP_PASSWORD')
+    RUNNING_BOTS[name] = bot_class(app_id, app_password)
+    ROUTES[app_id] = (create_adapter(app_id, app_password), RUNNING_BOTS[name])
+ALFAS_BOT = RUNNING_BOTS.get('ALFAS')
 
 # Create Admin bot
-ADMIN_SETTINGS = BotFrameworkAdapterSettings(CONFIG.ADMIN_APP_ID, CONFIG.ADMIN_APP_PASSWORD)
-ADMIN_ADAPTER = BotFrameworkAdapter(ADMIN_SETTINGS)
-ADMIN_ADAPTER.on_turn_error = on_error
-ADMIN_APP_ID = ADMIN_SETTINGS.app_id if ADMIN_SETTINGS.app_id else uuid.uuid4()
-ADMIN_BOT = StickyADMINBot(CONFIG.ADMIN_APP_ID, CONFIG.ADMIN_APP_PASSWORD,
-                           ALFAS_BOT,
-                           UITHOF_BOT)
+ADMIN_ADAPTER = create_adapter(CONFIG.ADMIN_APP_ID, CONFIG.ADMIN_APP_PASSWORD)
+ADMIN_BOT = StickyADMINBot(CONFIG.ADMIN_APP_ID, CONFIG.ADMIN_APP_PASSWORD, RUNNING_BOTS)
+ROUTES[CONFIG.ADMIN_APP_ID] = (ADMIN_ADAPTER, ADMIN_BOT)
+# The stored reminders are sent by the admin bot.
+reminders.register_adapter(CONFIG.ADMIN_APP_ID, ADMIN_ADAPTER)
+
+print(f"Started {', '.join(BOTS + ['ADMIN'])} in {time.monotonic() - STARTUP_TIME:.3f} seconds")
 
 APP = web.Application(middlewares=[aiohttp_error_middleware])
 
+# Keeps the lock state, caches and scheduler of this worker in line with the other workers.
+COORDINATOR = Coordinator(RUNNING_BOTS, ALFAS_BOT.scheduler if ALFAS_BOT else None,
+                          CONFIG.SHARED_STATE_INTERVAL, CONFIG.SCHEDULER_LEASE,
+                          [ALFAS_BOT.open_cards.refresh] if ALFAS_BOT else [])
+
+# Start the scheduler, which loads the stored reminders from the database. It starts paused,
+# the coordinator resumes it in the one worker that holds the scheduler lease.
+async def on_startup(app):
+    if ALFAS_BOT:
+        start_time = time.monotonic()
+        ALFAS_BOT.scheduler.start(paused=True)
+        stats = await ALFAS_BOT.reminders.stats()
+        print(f"Loaded {stats['reminders']} reminders in {stats['jobs']} jobs in {time.monotonic() - start_time:.3f} seconds")
+    await COORDINATOR.start()
+
+# Export the enrollments that are still queued and stop the scheduler before the server stops.
+async def on_shutdown(app):
+    await COORDINATOR.stop()
+    if ALFAS_BOT:
+        await ALFAS_BOT.enrollment_sync.stop()
+        if ALFAS_BOT.scheduler.running:
+            ALFAS_BOT.scheduler.shutdown(wait=False)
+
+APP.on_startup.append(on_startup)
+APP.on_shutdown.append(on_shutdown)
+
 # Listen for incoming requests on /api/messages.
 async def messages(req: Request) -> Response:
     # Main bot message handler.
-    if "application/json" in req.headers["Content-Type"]:
+    if "application/json" in req.headers.get("Content-Type", ""):
         body = await req.json()
     else:
         return Response(status=HTTPStatus.UNSUPPORTED_MEDIA_TYPE)
 
-    bot_id = body['recipient']['id'].split(':')[1]
+    # The recipient id is '28:<app id>'. Activities for bots that are not running are rejected right away.
+    recipient_id = (body.get('recipient') or {}).get('id') or ''
+    route = ROUTES.get(recipient_id.split(':', 1)[-1])
+    if route is None:
+        return Response(status=HTTPStatus.NOT_FOUND)
+    adapter, bot = route
 
     activity = Activity().deserialize(body)
     auth_header = req.headers["Authorization"] if "Authorization" in req.headers else ""
 
-    if bot_id == CONFIG.ALFAS_APP_ID:
-        response = await ALFAS_ADAPTER.process_activity(activity, auth_header, ALFAS_BOT.on_turn)
-    elif bot_id == CONFIG.UITHOF_APP_ID:
-        response = await UITHOF_ADAPTER.process_activity(activity, auth_header, UITHOF_BOT.on_turn)
-    elif bot_id == CONFIG.ADMIN_APP_ID:
-        response = await ADMIN_ADAPTER.process_activity(activity, auth_header, ADMIN_BOT.on_turn)
-
+    response = await adapter.process_activity(activity, auth_header, bot.on_turn)
     if response:
         return json_response(data=response.body, status=response.status)
     return Response(status=HTTPStatus.OK)
 
-if ALFAS_BOT:
-    APP.router.add_post("/api/alfas/messages", messages)
-if UITHOF_BOT:
-    APP.router.add_post("/api/uithof/messages", messages)
+for name in BOTS:
+    APP.router.add_post(BOT_REGISTRY[name][1], messages)
 APP.router.add_post("/api/admin/messages", messages)
 
 
+def run_worker():
+    # Database connections that were opened before the fork must not be shared between the workers.
+    db.engine.dispose()
+    db.jobs_engine.dispose()
+    # With several workers the kernel spreads the connections over the processes that listen on the port.
+    web.run_app(APP, host="localhost", port=CONFIG.PORT, reuse_port=CONFIG.WORKERS > 1)
+
 if __name__ == "__main__":
     try:
-        web.run_app(APP, host="localhost", port=CONFIG.PORT)
+        if CONFIG.WORKERS > 1:
+            # The workers are forked after the bots are built, so they share the startup work. Linux only.
+            context = multiprocessing.get_context('fork')
+            workers = [context.Process(target=run_worker) for _ in range(CONFIG.WORKERS)]
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+        else:
+            run_worker()
     except Exception as error:
         raise error
\ No newline at end of file
@@ -0,0 +1,30 @@
+"""
+    Shared setup of the benchmarks. Import this module before anything of the bot: it moves to a temporary
+    directory, so the benchmarks run against a fresh database instead of data/database.sqlite.
+"""
+import os
+import sys
+import asyncio
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(tempfile.mkdtemp(prefix='intro-bot-benchmark-'))
+
+def run(coroutine):
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+def report(name, durations):
+    """Prints the mean, p50, p99 and max of a list of durations in seconds."""
+    print(f"{name:<40} n={len(durations):<6} mean={sum(durations) / len(durations) * 1000:8.2f} ms  "
+          f"p50={percentile(durations, 0.5) * 1000:8.2f} ms  p99={percentile(durations, 0.99) * 1000:8.2f} ms  "
+          f"max={max(durations) * 1000:8.2f} ms")
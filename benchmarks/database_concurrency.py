@@ -0,0 +1,70 @@
+"""
+    Throughput of concurrent turns that each read and write the database with their own session, with the
+    rollback journal (DatabaseJournalMode=DELETE, DatabaseSynchronous=FULL, the SQLite defaults) next to the
+    defaults of the bot (WAL, synchronous=NORMAL). Every turn keeps its session open across its awaits, like
+    the bot handlers do. The pragmas are applied when the database module is imported, so every profile runs
+    in a process of its own, on a fresh database.
+
+        python benchmarks/database_concurrency.py [turns ...]
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import subprocess
+import common
+import modules.database as db
+
+TIMEOUT = 60
+
+# Name, DatabaseJournalMode and DatabaseSynchronous.
+PROFILES = [('rollback journal', 'DELETE', 'FULL'), ('WAL', 'WAL', 'NORMAL')]
+
+async def turn(number):
+    session = db.Session()
+    try:
+        await db.getFirst(session, db.MentorGroup, 'name', f'groep {number % 50}')
+        await db.dbInsert(session, db.Enrollment(committee_id=1, first_name='Test', last_name=str(number),
+                                                 email_address=f'{number}@{time.monotonic()}'))
+    finally:
+        session.close()
+
+async def measure(concurrency):
+    """Turns per second for every number of concurrent turns, None when they did not finish within TIMEOUT."""
+    session = db.Session()
+    await db.dbInsertAll(session, [db.Committee(name='commissie', info='', channel_id='committee')] +
+                                  [db.MentorGroup(name=f'groep {i}', channel_id=f'channel {i}') for i in range(50)])
+    session.close()
+
+    results = {}
+    for turns in concurrency:
+        start_time = time.monotonic()
+        try:
+            await asyncio.wait_for(asyncio.gather(*[turn(i) for i in range(turns)]), TIMEOUT)
+        except asyncio.TimeoutError:
+            results[turns] = None
+            break
+        results[turns] = turns / (time.monotonic() - start_time)
+    return results
+
+def run_profile(journal_mode, synchronous, concurrency):
+    environment = dict(os.environ, DatabaseJournalMode=journal_mode, DatabaseSynchronous=synchronous)
+    output = subprocess.run([sys.executable, os.path.abspath(__file__), '--measure'] + [str(turns) for turns in concurrency],
+                            env=environment, stdout=subprocess.PIPE, check=True, universal_newlines=True).stdout
+    return {int(turns): result for turns, result in json.loads(output.splitlines()[-1]).items()}
+
+def main(concurrency):
+    results = [run_profile(journal_mode, synchronous, concurrency) for _, journal_mode, synchronous in PROFILES]
+    print(f"{'turns':>5}" + ''.join(f"{f'{name} (turns/s)':>30}" for name, _, _ in PROFILES))
+    for turns in concurrency:
+        # A profile stops at its first timeout, the larger numbers of turns are not run.
+        cells = ['-' if turns not in result else 'timeout' if result[turns] is None else f'{result[turns]:.0f}'
+                 for result in results]
+        print(f"{turns:5}" + ''.join(f"{cell:>30}" for cell in cells))
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['--measure']:
+        print(json.dumps(common.run(measure([int(turns) for turns in sys.argv[2:]]))))
+    else:
+        main([int(turns) for turns in sys.argv[1:]] or [10, 25, 50, 100, 200])
@@ -0,0 +1,57 @@
+"""
+    The free committees that a mentor group has not visited yet, with 200 committees and 20000 visits:
+    the NOT EXISTS query of db.getNonVisitedCommittees against the Python filter over the visits it replaced.
+
+        python benchmarks/non_visited_committees.py [committees] [visits] [calls]
+"""
+import sys
+import time
+import common
+import modules.database as db
+
+GROUPS = 200
+
+def non_visited_in_python(session, mg_id):
+    """getNonVisitedCommittees before the anti-join: every free committee checked against the visits of the group."""
+    visits = session.query(db.Visit).filter((db.Visit.mg_id == mg_id) & (db.Visit.finished == True))
+    committees = db.getAll.__wrapped__(session, db.Committee, 'occupied', False)
+    return_value = []
+
+    for committee in committees:
+        if next(filter(lambda visit: visit.committee_id == committee.committee_id, visits), None):
+            continue
+        return_value.append(committee)
+    return return_value
+
+async def fill(committees, visits):
+    session = db.Session()
+    await db.dbInsertAll(session, [db.Committee(name=f'commissie {i}', info='', channel_id=f'committee {i}')
+                                   for i in range(committees)] +
+                                  [db.MentorGroup(name=f'groep {i}', channel_id=f'channel {i}') for i in range(GROUPS)])
+    # Every group visited a different part of the committees.
+    await db.dbInsertAll(session, [db.Visit(mg_id=i % GROUPS + 1, committee_id=(i * 7 + i // GROUPS) % committees + 1,
+                                            finished=True) for i in range(visits)])
+    session.close()
+
+def measure(name, function, calls):
+    session = db.Session()
+    durations = []
+    results = []
+    for call in range(calls):
+        start_time = time.monotonic()
+        results.append(sorted(committee.committee_id for committee in function(session, call % GROUPS + 1)))
+        durations.append(time.monotonic() - start_time)
+    session.close()
+    common.report(name, durations)
+    return results
+
+async def main(committees, visits, calls):
+    await fill(committees, visits)
+    print(f"{committees} committees, {GROUPS} mentor groups, {visits} visits")
+    before = measure('Python filter (before)', non_visited_in_python, calls)
+    after = measure('NOT EXISTS query', db.getNonVisitedCommittees.__wrapped__, calls)
+    assert before == after
+
+if __name__ == '__main__':
+    arguments = [int(argument) for argument in sys.argv[1:]]
+    common.run(main(*(arguments + [200, 20000, 50][len(arguments):])))
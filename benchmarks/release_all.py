@@ -0,0 +1,54 @@
+"""
+    AllesVrijgeven on 100 mentor groups, 100 committees and 5000 visits: the three bulk updates of
+    db.releaseAll against the row by row merge and commit it replaced.
+
+        python benchmarks/release_all.py [groups] [visits]
+"""
+import sys
+import time
+import common
+import modules.database as db
+
+async def fill(groups, visits):
+    session = db.Session()
+    with db.engine.begin() as connection:
+        for table in (db.Visit.__table__, db.MentorGroup.__table__, db.Committee.__table__):
+            connection.execute(table.delete())
+    await db.dbInsertAll(session, [db.Committee(name=f'commissie {i}', info='', channel_id=f'committee {i}', occupied=True)
+                                   for i in range(groups)] +
+                                  [db.MentorGroup(name=f'groep {i}', channel_id=f'channel {i}', occupied=True)
+                                   for i in range(groups)])
+    # Every group visits one committee right now, the other visits are finished.
+    await db.dbInsertAll(session, [db.Visit(mg_id=i % groups + 1, committee_id=(i * 7) % groups + 1, finished=i >= groups)
+                                   for i in range(visits)])
+    session.close()
+
+async def release_row_by_row(session):
+    """AllesVrijgeven before db.releaseAll: every row loaded, changed and committed on its own."""
+    for table in (db.Visit, db.MentorGroup, db.Committee):
+        for row in await db.getTable(session, table):
+            if table is db.Visit:
+                row.finished = True
+            else:
+                row.occupied = False
+            await db.dbMerge(session, row)
+
+async def measure(name, release, groups, visits):
+    await fill(groups, visits)
+    session = db.Session()
+    start_time = time.monotonic()
+    await release(session)
+    duration = time.monotonic() - start_time
+    active = session.query(db.Visit).filter(db.Visit.finished == False).count()
+    session.close()
+    assert active == 0
+    print(f"{name:<28} {duration * 1000:9.1f} ms")
+
+async def main(groups, visits):
+    print(f"{groups} groups, {groups} committees, {visits} visits")
+    await measure('row by row (before)', release_row_by_row, groups, visits)
+    await measure('db.releaseAll', db.releaseAll, groups, visits)
+
+if __name__ == '__main__':
+    arguments = [int(argument) for argument in sys.argv[1:]]
+    common.run(main(*(arguments or [100, 5000])))
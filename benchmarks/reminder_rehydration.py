@@ -0,0 +1,100 @@
+"""
+    Rehydration of the reminders of 200 mentor groups with N associations each: scheduling them,
+    loading them again at a restart and rebuilding them like HerstartScheduler. Next to the duration it shows
+    the longest stall of the event loop, since the job store is only used on the database executor.
+
+        python benchmarks/reminder_rehydration.py [associations ...]
+"""
+import sys
+import time
+import asyncio
+import datetime
+import common
+from apscheduler.schedulers.asyncio import AsyncIOScheduler
+from apscheduler.jobstores.sqlalchemy import SQLAlchemyJobStore
+import modules.database as db
+import modules.reminders as reminders
+from config import DefaultConfig
+
+GROUPS = 200
+CONVERSATION_REFERENCE = {'serviceUrl': 'https://smba.trafficmanager.net/emea/'}
+
+class LoopMonitor:
+    """Measures how late a task that wakes up every millisecond is, i.e. how long the event loop was blocked."""
+    def __init__(self):
+        self.longest_stall = 0
+        self._task = asyncio.ensure_future(self._run())
+
+    async def _run(self):
+        while True:
+            start_time = time.monotonic()
+            await asyncio.sleep(0.001)
+            self.longest_stall = max(self.longest_stall, time.monotonic() - start_time - 0.001)
+
+    def stop(self):
+        self._task.cancel()
+        return self.longest_stall
+
+def timeslot_reminders(associations):
+    """The reminders 5 and 1 minutes before the timeslots, which are spread over the afternoon in steps of 5 minutes."""
+    day = DefaultConfig.ALFAS_DATE
+    result = []
+    for group in range(GROUPS):
+        for association in range(associations):
+            timeslot = datetime.datetime.combine(day, datetime.time(13)) + datetime.timedelta(minutes=5 * ((group + association) % 48))
+            result.extend((timeslot - datetime.timedelta(minutes=minutes),
+                           {'channel_id': f'channel {group}', 'mg_id': group, 'association': f'vereniging {association}',
+                            'minutes': minutes})
+                          for minutes in [1, 5])
+    return result
+
+def new_engine():
+    scheduler = AsyncIOScheduler(jobstores={'default': SQLAlchemyJobStore(engine=db.jobs_engine)})
+    return scheduler, reminders.ReminderEngine(scheduler)
+
+async def measure(name, coroutine):
+    monitor = LoopMonitor()
+    # The monitor has to be waiting before the work starts and wake up once after it, to see a blocked loop.
+    await asyncio.sleep(0.01)
+    start_time = time.monotonic()
+    result = await coroutine
+    duration = time.monotonic() - start_time
+    await asyncio.sleep(0.01)
+    print(f"  {name:<28} {duration * 1000:9.1f} ms, event loop blocked at most {monitor.stop() * 1000:7.1f} ms")
+    return result
+
+async def main(associations_counts):
+    for associations in associations_counts:
+        reminder_list = timeslot_reminders(associations)
+        print(f"{GROUPS} groups x {associations} associations: {len(reminder_list)} reminders")
+
+        scheduler, engine = new_engine()
+        scheduler.start(paused=True)
+        await measure('schedule', engine.schedule('app', CONVERSATION_REFERENCE, reminder_list))
+        scheduler.shutdown(wait=False)
+        await asyncio.sleep(0)
+
+        # A restart: a new scheduler loads the jobs from the job store, like on_startup in app.py.
+        scheduler, engine = new_engine()
+        async def restart():
+            scheduler.start(paused=True)
+            return await engine.stats()
+        stats = await measure('restart and load', restart())
+        assert stats['reminders'] == len(reminder_list), stats
+
+        async def rebuild():
+            await engine.remove()
+            await engine.schedule('app', CONVERSATION_REFERENCE, reminder_list)
+        await measure('rebuild (HerstartScheduler)', rebuild())
+        await measure('delay one association', engine.delay('vereniging 0', 15))
+        # Before, the job store was used on the event loop itself.
+        async def delay_on_loop():
+            engine._delay('vereniging 0', -15)
+        await measure('  idem, on the event loop', delay_on_loop())
+
+        await engine.remove()
+        scheduler.shutdown(wait=False)
+        await asyncio.sleep(0)
+
+if __name__ == '__main__':
+    common.run(main([int(associations) for associations in sys.argv[1:]] or [1, 2, 4]))
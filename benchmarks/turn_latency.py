@@ -0,0 +1,104 @@
+"""
+    Latency of bot turns that arrive while others are still running. Every turn does the reads of a
+    RandomCommittee click and waits for Teams, every tenth turn also writes an enrollment. Before, the helpers ran
+    on the event loop itself (their blocking version, `helper.__wrapped__`), so every turn also waited for the
+    queries of all other turns. Now they run on the database executor.
+
+    The second round adds another worker process that holds the write lock for 500 ms every 2 seconds, e.g. for a
+    large import. A write then waits for the lock: on the event loop all turns wait, on the executor only the turns
+    that write, until the writes occupy all DATABASE_WORKERS threads. Without it the queries take a few milliseconds
+    of Python work, which the executor cannot run in parallel, so the hop to the executor costs a little extra.
+
+        python benchmarks/turn_latency.py [turns] [interval in ms]
+"""
+import sys
+import time
+import asyncio
+import threading
+import common
+import modules.database as db
+
+GROUPS = 200
+COMMITTEES = 200
+VISITS = 20000
+TEAMS_LATENCY = 0.02 # seconds for a message to Teams
+HOLD, EVERY = 0.5, 2 # seconds that another worker holds the write lock, and how often
+
+async def fill():
+    session = db.Session()
+    await db.dbInsertAll(session, [db.Committee(name=f'commissie {i}', info='', channel_id=f'committee {i}')
+                                   for i in range(COMMITTEES)] +
+                                  [db.MentorGroup(name=f'groep {i}', channel_id=f'channel {i}') for i in range(GROUPS)])
+    await db.dbInsertAll(session, [db.Visit(mg_id=i % GROUPS + 1, committee_id=i // GROUPS % COMMITTEES + 1, finished=True)
+                                   for i in range(VISITS)])
+    session.close()
+
+class OtherWorker:
+    """Holds the write lock of the database for `hold` seconds every `every` seconds, from its own connection."""
+    def __init__(self, hold=0.05, every=0.2):
+        self.hold = hold
+        self.every = every
+        self._stopping = threading.Event()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.start()
+
+    def _run(self):
+        connection = db.engine.raw_connection()
+        cursor = connection.cursor()
+        while not self._stopping.wait(self.every - self.hold):
+            cursor.execute('BEGIN IMMEDIATE')
+            time.sleep(self.hold)
+            connection.commit()
+        connection.close()
+
+    def stop(self):
+        self._stopping.set()
+        self._thread.join()
+
+def on_loop(helper):
+    """The helper as it was called before: blocking, on the event loop."""
+    async def blocking(*args):
+        return helper.__wrapped__(*args)
+    return blocking
+
+async def turn(number, helpers):
+    get_first, get_non_visited, get_active_visit, insert = helpers
+    start_time = time.monotonic()
+    session = db.Session()
+    try:
+        mentor_group = await get_first(session, db.MentorGroup, 'channel_id', f'channel {number % GROUPS}')
+        await get_active_visit(session, mentor_group.mg_id)
+        await get_non_visited(session, mentor_group.mg_id)
+        if number % 10 == 0:
+            await insert(session, db.Enrollment(committee_id=1, first_name='Test', last_name=str(number),
+                                                email_address=f'{number}@{start_time}'))
+        await asyncio.sleep(TEAMS_LATENCY)
+    finally:
+        session.close()
+    return time.monotonic() - start_time
+
+async def measure(name, helpers, turns, interval):
+    tasks = []
+    for number in range(turns):
+        tasks.append(asyncio.ensure_future(turn(number, helpers)))
+        await asyncio.sleep(interval)
+    common.report(name, await asyncio.gather(*tasks))
+
+async def main(turns, interval):
+    await fill()
+    print(f"{turns} turns, one every {interval * 1000:.0f} ms, {COMMITTEES} committees and {VISITS} visits")
+    awaitable = (db.getFirst, db.getNonVisitedCommittees, db.getActiveVisitMG, db.dbInsert)
+    await measure('on the event loop (before)', [on_loop(helper) for helper in awaitable], turns, interval)
+    await measure('on the database executor', awaitable, turns, interval)
+
+    print(f"With another worker that holds the write lock for {HOLD * 1000:.0f} ms every {EVERY * 1000:.0f} ms")
+    other_worker = OtherWorker(HOLD, EVERY)
+    try:
+        await measure('on the event loop (before)', [on_loop(helper) for helper in awaitable], turns, interval)
+        await measure('on the database executor', awaitable, turns, interval)
+    finally:
+        other_worker.stop()
+
+if __name__ == '__main__':
+    arguments = sys.argv[1:]
+    common.run(main(int(arguments[0]) if arguments else 500, float(arguments[1]) / 1000 if len(arguments) > 1 else 0.01))
@@ -0,0 +1,139 @@
+"""
+    Throughput of 1, 2 and 4 worker processes on the same port, like app.py with Workers=N: the
+    workers are forked after the database is filled and listen with SO_REUSEPORT, so the kernel spreads the
+    connections over them. Every request does the work of a RandomCommittee click: the reads of the mentor group,
+    its visit and the committees it has not visited, the committee card rendered and serialized like a reply, and
+    for every tenth request an enrollment written. A client keeps a fixed number of requests in flight.
+
+    The Bot Framework part of a turn (authentication and the replies to Teams) is left out, it needs Teams
+    credentials. The Python work of a turn runs on one core per worker, so the throughput only grows with the
+    workers up to the number of cores, and the writes all wait for the one write lock of the database.
+    The client runs in a process of its own as well, so this process forks before it has any threads or event
+    loop, like app.py.
+
+        python benchmarks/worker_throughput.py [seconds] [in flight] [workers...]
+"""
+import os
+import sys
+import time
+import socket
+import asyncio
+import multiprocessing
+import aiohttp
+from aiohttp import web
+import common
+from botbuilder.core import MessageFactory
+import modules.database as db
+from modules.committee_card import CommitteeCardRenderer
+
+GROUPS = 200
+COMMITTEES = 200
+VISITS = 20000
+
+def fill():
+    # Blocking, so the database executor does not start threads before the fork.
+    session = db.Session()
+    db.dbInsertAll.__wrapped__(session, [db.Committee(name=f'commissie {i}', info='', channel_id=f'committee {i}')
+                                         for i in range(COMMITTEES)] +
+                                        [db.MentorGroup(name=f'groep {i}', channel_id=f'channel {i}') for i in range(GROUPS)])
+    db.dbInsertAll.__wrapped__(session, [db.Visit(mg_id=i % GROUPS + 1, committee_id=i // GROUPS % COMMITTEES + 1,
+                                                  finished=True) for i in range(VISITS)])
+    session.close()
+
+def create_app():
+    renderer = CommitteeCardRenderer()
+
+    async def turn(request):
+        number = int(request.query['n'])
+        session = db.Session()
+        try:
+            mentor_group = await db.getFirst(session, db.MentorGroup, 'channel_id', f'channel {number % GROUPS}')
+            await db.getActiveVisitMG(session, mentor_group.mg_id)
+            committees = await db.getNonVisitedCommittees(session, mentor_group.mg_id)
+            reply = MessageFactory.attachment(await renderer.render()).serialize()
+            if number % 10 == 0:
+                await db.dbInsert(session, db.Enrollment(committee_id=1, first_name='Test', last_name=str(number),
+                                                         email_address=f'{os.getpid()}.{number}@{time.time()}'))
+        finally:
+            session.close()
+        return web.json_response({'committees': len(committees), 'reply': len(str(reply))})
+
+    app = web.Application()
+    app.router.add_get('/turn', turn)
+    return app
+
+def run_worker(port):
+    # Database connections that were opened before the fork must not be shared between the workers.
+    db.engine.dispose()
+    web.run_app(create_app(), host='127.0.0.1', port=port, reuse_port=True, print=None)
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+async def wait_until_listening(client, url):
+    for _ in range(200):
+        try:
+            async with client.get(url, params={'n': 1}) as response:
+                await response.read()
+                return
+        except aiohttp.ClientConnectionError:
+            await asyncio.sleep(0.05)
+    raise RuntimeError("The workers did not start")
+
+async def load(url, seconds, in_flight):
+    """Keeps `in_flight` requests running for `seconds` seconds. Returns the durations and the total time."""
+    durations = []
+    # One connection per request, so the kernel can hand every request to another worker.
+    async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(force_close=True)) as client:
+        await wait_until_listening(client, url)
+        end_time = time.monotonic() + seconds
+        counter = iter(range(sys.maxsize))
+
+        async def user():
+            while time.monotonic() < end_time:
+                start_time = time.monotonic()
+                async with client.get(url, params={'n': next(counter)}) as response:
+                    await response.read()
+                    assert response.status == 200
+                durations.append(time.monotonic() - start_time)
+
+        start_time = time.monotonic()
+        await asyncio.gather(*[user() for _ in range(in_flight)])
+        return durations, time.monotonic() - start_time
+
+def run_client(connection, url, seconds, in_flight):
+    connection.send(common.run(load(url, seconds, in_flight)))
+    connection.close()
+
+def measure(workers, seconds, in_flight):
+    port = free_port()
+    context = multiprocessing.get_context('fork')
+    processes = [context.Process(target=run_worker, args=(port,)) for _ in range(workers)]
+    for process in processes:
+        process.start()
+    receiver, sender = context.Pipe(duplex=False)
+    client = context.Process(target=run_client, args=(sender, f'http://127.0.0.1:{port}/turn', seconds, in_flight))
+    client.start()
+    try:
+        durations, duration = receiver.recv()
+    finally:
+        client.join()
+        for process in processes:
+            process.terminate()
+            process.join()
+
+    common.report(f'{workers} workers, {len(durations) / duration:7.1f} requests/s', durations)
+
+def main(seconds, in_flight, worker_counts):
+    fill()
+    print(f"{in_flight} requests in flight for {seconds} s per run, {os.cpu_count()} cores, "
+          f"{COMMITTEES} committees and {VISITS} visits")
+    for workers in worker_counts:
+        measure(workers, seconds, in_flight)
+
+if __name__ == '__main__':
+    arguments = sys.argv[1:]
+    main(float(arguments[0]) if arguments else 5, int(arguments[1]) if len(arguments) > 1 else 32,
+         [int(argument) for argument in arguments[2:]] or [1, 2, 4])
@@ -1,142 +1,110 @@
 # The admin bot (for the cool kids)
 
+import asyncio
 import datetime
+import time
 from botbuilder.core import CardFactory, TurnContext, MessageFactory
 from botbuilder.core.teams import TeamsActivityHandler, TeamsInfo
 from botbuilder.schema import CardAction, HeroCard, Mention, ConversationParameters
 from botbuilder.schema.teams import TeamsChannelAccount
 from botbuilder.schema._connector_client_enums import ActionTypes
-from apscheduler.schedulers.asyncio import AsyncIOScheduler
 import modules.database as db
 import modules.helper_funtions as helper
+from modules import commands
+from modules.commands import Command, CommandRouter
+from modules import outbound
+from modules.role_index import role_index
 from config import DefaultConfig
-from google_api import GoogleSheet
+from google_api import get_sheet
 
 
 class StickyADMINBot(TeamsActivityHandler):
-    def __init__(self, app_id: str, app_password: str, alfas, uithof):
+    def __init__(self, app_id: str, app_password: str, bots):
         self._app_id = app_id
         self._app_password = app_password
         self.CONFIG = DefaultConfig()
-        self.alfas_bot = alfas # alfas bot object
-        self.uithof_bot = uithof # uithof bot object
+        self.bots = bots # the running bots by name, e.g. 'ALFAS'
+        self.alfas_bot = bots.get('ALFAS') # alfas bot object
+        self.uithof_bot = bots.get('UITHOF') # uithof bot object
         self.just_booted = True
 
+    # Manual user registration functions (IkBen...) are used when users need to be added after initialization.
+    # They are password protected and their existance should only be leaked to those that need it.
+    # In the bot documentation, someone should be pointed to a bot admin if there are problems.
+    # All other commands can only be used by admins.
+    COMMANDS = CommandRouter('ADMIN', [
+        # Register a user as an intro user, a mentor or a committee member
+        Command("IkBenIntro", 'register_intro', max_args=None),
+        Command("IkBenMentor", 'register_mentor', max_args=None),
+        Command("IkBenCommissielid", 'register_committee_member', max_args=None, requires='alfas_bot'),
+        Command("GebruikersInfo", 'user_info'),
+        # Fully initialize bot (we might want to add separate inits)
+        Command("Initialiseren", 'initialize', role='admin'),
+        Command("HerstartScheduler", 'restart_scheduler', role='admin', requires='alfas_bot'),
+        Command("HerinneringenStatus", 'reminder_status', role='admin', requires='alfas_bot'),
+        # Forget all downloaded sheets, e.g. when the cache does not notice a change.
+        Command("SheetCacheLegen", 'flush_sheet_cache', role='admin'),
+        # Add a committee, mentor group or USP location and their follow-up registering
+        Command("CommissieToevoegen", 'add_committee', max_args=None, role='admin', requires='alfas_bot'),
+        Command("RegCommittee", 'register_committee', max_args=None, role='admin', requires='alfas_bot'),
+        Command("MentorgroepToevoegen", 'add_mentor_group', max_args=None, role='admin'),
+        Command("RegMentorGroup", 'register_mentor_group', max_args=None, role='admin'),
+        Command("USPlocatieToevoegen", 'add_USP_location', max_args=None, role='admin', requires='uithof_bot'),
+        Command("RegUSPLocation", 'register_USP_location', max_args=None, role='admin', requires='uithof_bot'),
+        # Send a message to all channels of one type: Omroepen <mentorgroepen, commissies of usp> <bericht>
+        Command("Omroepen", 'broadcast_command', max_args=None, role='admin'),
+        Command("Activeer", 'unlock_bot', min_args=1, max_args=1, role='admin',
+                usage="Je moet specificeren welke bot je wilt activeren: Activeer <naam van de bot, bijv. 'alfas'>"),
+        Command("Deactiveer", 'lock_bot', min_args=1, max_args=1, role='admin',
+                usage="Je moet specificeren welke bot je wilt deactiveren: Deactiveer <naam van de bot, bijv. 'alfas'>"),
+        Command("CommandoStatistieken", 'command_stats', role='admin'),
+    ], "Ik ken dit commando niet. Misschien heb je een typfout gemaakt?")
+
     async def on_message_activity(self, turn_context: TurnContext):
         TurnContext.remove_recipient_mention(turn_context.activity)
         turn_context.activity.text = turn_context.activity.text.strip()
+        await self.COMMANDS.dispatch(self, turn_context)
 
-        # Manual user registration functions. To be used when users need to be added after initialization.
-        # These functions are password protected and their existance should only be leaked to those that need it.
-        # In the bot documentation, someone should be pointed to a bot admin if there are problems.
-
-        # Register a user as an intro user
-        if turn_context.activity.text.startswith("IkBenIntro"):
-            await self.register_intro(turn_context)
-            return
-
-        # Register a user as a mentor
-        if turn_context.activity.text.startswith("IkBenMentor"):
-            await self.register_mentor(turn_context)
-            return
-
-        # Register a user as a committee member
-        if turn_context.activity.text.startswith("IkBenCommissielid"):
-            if self.alfas_bot:
-                await self.register_committee_member(turn_context)
-            else:
-                await turn_context.send_activity("Dit commando is niet actief omdat de bijbehorende bot niet draait.")
-            return
-        
-        if turn_context.activity.text == "GebruikersInfo":
-            await self.user_info(turn_context)
-            return
-
-        user = await TeamsInfo.get_member(turn_context, turn_context.activity.from_property.id)
+    async def check_role(self, turn_context: TurnContext, role):
+        user = await helper.get_member(turn_context)
         user_full_name = user.given_name + " " + user.surname
 
-        session = db.Session()
-        if not db.getUserOnType(session, 'intro_user', user.id) and user_full_name not in self.CONFIG.MAIN_ADMIN:
+        if not role_index.get(helper.get_user_id(user), 'intro_user') and user_full_name not in self.CONFIG.MAIN_ADMIN:
             await turn_context.send_activity("Je bent geen administrator en kan dit command dus niet uitvoeren!")
-            session.close()
-            return
-        session.close()
-
-        # Fully initialize bot (we might want to add separate inits)
-        if turn_context.activity.text == "Initialiseren":
-            await self.initialize(turn_context)
-            return
-        
-        if turn_context.activity.text == "HerstartScheduler":
-            session = db.Session()
-            await self.restart_scheduler(turn_context, session)
-            session.close()
-            return
-        
-        # Add a committee        
-        if turn_context.activity.text.startswith("CommissieToevoegen"):
-            if self.alfas_bot:
-                await self.add_committee(turn_context)
-            else:
-                await turn_context.send_activity("Dit commando is niet actief omdat de bijbehorende bot niet draait.")
-            return
+            return False
+        return True
 
-        # Follow-up registering of a committee
-        if turn_context.activity.text.startswith("RegCommittee"):
-            if self.alfas_bot:
-                await self.register_committee(turn_context)
-            else:
-                await turn_context.send_activity("Dit commando is niet actief omdat de bijbehorende bot niet draait.")
-            return
+    async def on_teams_members_added(self, teams_members_added, team_info, turn_context: TurnContext):
+        helper.invalidate_members(teams_members_added)
+        return await super().on_teams_members_added(teams_members_added, team_info, turn_context)
 
-        # Add a mentor group
-        if turn_context.activity.text.startswith("MentorgroepToevoegen"):
-            await self.add_mentor_group(turn_context)
-            return
+    async def on_teams_members_removed(self, teams_members_removed, team_info, turn_context: TurnContext):
+        helper.invalidate_members(teams_members_removed)
+        return await super().on_teams_members_removed(teams_members_removed, team_info, turn_context)
 
-        # Follow-up registering of a mentor group
-        if turn_context.activity.text.startswith("RegMentorGroup"):
-            await self.register_mentor_group(turn_context)
-            return
-        
-        if turn_context.activity.text.startswith("USPlocatieToevoegen"):
-            if self.uithof_bot:
-                await self.add_USP_location(turn_context)
-            else:
-                await turn_context.send_activity("Dit commando is niet actief omdat de bijbehorende bot niet draait.")
-            return
-
-        # Follow-up registering of a committee
-        if turn_context.activity.text.startswith("RegUSPLocation"):
-            if self.uithof_bot:
-                await self.register_USP_location(turn_context)
-            else:
-                await turn_context.send_activity("Dit commando is niet actief omdat de bijbehorende bot niet draait.")
-            return
-        
-        if turn_context.activity.text.startswith("Activeer"): #followed by one of ['alfas', 'c88', 'uithof']
-            await self.unlock_bot(turn_context)
-            return
-
-        if turn_context.activity.text.startswith("Deactiveer"): #followed by one of ['alfas', 'c88', 'uithof']
-            await self.lock_bot(turn_context)
-            return
-
-        await turn_context.send_activity("Ik ken dit commando niet. Misschien heb je een typfout gemaakt?")
-    
     # Main initialize Method
     async def initialize(self, turn_context: TurnContext):
         session = db.Session()
 
+        # All sheets are downloaded in one request, together with the members of the team.
+        # This runs in the background while the channels are initialized.
+        sheet_ranges = [self.CONFIG.ALFAS_MEMBERS_RANGE]
+        if self.alfas_bot: # timeslots are only needed when the alfas bot is launched.
+            sheet_ranges.append(self.CONFIG.ALFAS_TIMESLOTS_RANGE)
+        sheet = await get_sheet()
+        downloads = asyncio.gather(sheet.get_ranges(sheet_ranges), self.get_team_members(turn_context))
+
         # Init channels
         await self.init_channels(turn_context, session)
 
+        sheet_values, members = await downloads
+
         # Init members
-        await self.init_members(turn_context, session)
+        await self.init_members(turn_context, session, sheet_values[self.CONFIG.ALFAS_MEMBERS_RANGE], members)
 
         # Init timeslots
         if self.alfas_bot: # only needs to be done when the alfas bot is launched.
-            await self.init_timeslots(turn_context, session)
+            await self.init_timeslots(turn_context, session, sheet_values[self.CONFIG.ALFAS_TIMESLOTS_RANGE])
 
         session.close()
         #Feedback to user.
@@ -150,90 +118,58 @@ class StickyADMINBot(TeamsActivityHandler):
         # Get all channels of the team
         channels = await TeamsInfo.get_team_channels(turn_context)
 
+        # For every channel prefix: (database class, existing groups by name, channel message).
+        channel_types = {'Mentorgroep': (db.MentorGroup, await db.getTable(session, db.MentorGroup),
+                                         "Dit kanaal is nu het botkanaal voor Mentorgroep: '{}'")}
+        if self.alfas_bot: # If the alfas bot is launched
+            channel_types['Commissie'] = (db.Committee, await db.getTable(session, db.Committee),
+                                          "Dit kanaal is nu het ALFASkanaal voor Commissie: '{}'")
+        if self.uithof_bot: # If the uithof bot is launched
+            channel_types['USP'] = (db.USPLocation, await db.getTable(session, db.USPLocation),
+                                    "Dit kanaal is nu het USPkanaal voor locatie: '{}'")
+        existing_groups = {prefix: {group.name: group for group in groups}
+                           for prefix, (_, groups, _) in channel_types.items()}
+
+        new_groups = []
+        channel_messages = []
         # For every channel we...
         for channel in channels:
             if channel.name is None:
                 continue
 
-            #Check if it is a "Mentorgroep" channel
-            if channel.name.startswith("Mentorgroep"):
-                # If so, add it to the database as a MentorGroup or update it.
+            for prefix, (group_class, _, message) in channel_types.items():
+                #Check if it is a channel of this type
+                if not channel.name.startswith(prefix):
+                    continue
+
+                # If so, add it to the database or update it.
                 group_name = ' '.join(channel.name.split()[1:])
-                existing_mentor_group = db.getFirst(session, db.MentorGroup, 'name', group_name)
+                existing_group = existing_groups[prefix].get(group_name)
 
-                if not existing_mentor_group:
-                    # Create mentor group
-                    mentor_group = db.MentorGroup(name=group_name, channel_id=channel.id)
-                    db.dbInsert(session, mentor_group)
-                else:
-                    # Update mentor group data
-                    existing_mentor_group.channel_id = channel.id
-                    existing_mentor_group.name = group_name
-                    db.dbMerge(session, existing_mentor_group)
-                # Notify the channel that it is now an ALFAS channel
-                init_message = MessageFactory.text(f"Dit kanaal is nu het botkanaal voor Mentorgroep: '{group_name}'")
-                try:
-                    await helper.create_channel_conversation(turn_context, channel.id, init_message)
-                except:
-                    pass
-
-            #Check if it is a "Commissie" channel
-            if self.alfas_bot: # If the alfas bot is launched
-                if channel.name.startswith("Commissie"):
-                    #If so, add it to the database as a Commissie or update it.
-                    committee_name = ' '.join(channel.name.split()[1:])
-                    existing_committee = db.getFirst(session, db.Committee, 'name', committee_name)
-
-                    if not existing_committee:
-                        committee = db.Committee(name=committee_name, info="", channel_id=channel.id)
-                        db.dbInsert(session, committee)
-                    else:
-                        existing_committee.channel_id = channel.id
-                        existing_committee.name = committee_name
-                        db.dbMerge(session, existing_committee)
-                    # Notify the channel that it is now an ALFAS channel
-                    init_message = MessageFactory.text(f"Dit kanaal is nu het ALFASkanaal voor Commissie: '{committee_name}'")
-                    try:
-                        await helper.create_channel_conversation(turn_context, channel.id, init_message)
-                    except:
-                        pass
-
-            #Check if it is a "usp location" channel
-            if self.uithof_bot: # If the uithof bot is launched
-                if channel.name.startswith("USP"):
-                    #If so, add it to the database as a Commissie or update it.
-                    location_name = ' '.join(channel.name.split()[1:])
-                    existing_location = db.getFirst(session, db.USPLocation, 'name', location_name)
-
-                    if not existing_location:
-                        location = db.USPLocation(name=location_name, info="", channel_id=channel.id)
-                        db.dbInsert(session, location)
+                if not existing_group:
+                    if group_class is db.MentorGroup:
+                        new_groups.append(group_class(name=group_name, channel_id=channel.id))
                     else:
-                        existing_location.channel_id = channel.id
-                        existing_location.name = location_name
-                        db.dbMerge(session, existing_location)
-                    # Notify the channel that it is now an USP channel
-                    init_message = MessageFactory.text(f"Dit kanaal is nu het USPkanaal voor locatie: '{location_name}'")
-                    try:
-                        await helper.create_channel_conversation(turn_context, channel.id, init_message)
-                    except:
-                        pass
+                        new_groups.append(group_class(name=group_name, info="", channel_id=channel.id))
+                else:
+                    existing_group.channel_id = channel.id
+                # Notify the channel that it is now a bot channel
+                channel_messages.append((channel.id, MessageFactory.text(message.format(group_name))))
+
+        # All groups are saved in one transaction, the fetched groups are updated in the session.
+        session.add_all(new_groups)
+        await db.dbCommit(session)
+
+        succeeded, failed = await helper.create_channel_conversations(turn_context, channel_messages)
 
         # Done with the channels
-        try:
-            await turn_context.send_activity("Alle groepen zijn geïnitialiseerd!")
-        except:
-            pass
+        await turn_context.send_activity(f"Alle groepen zijn geïnitialiseerd! {succeeded} kanalen zijn op de hoogte gebracht"
+                                         f"{f', {failed} berichten konden niet verstuurd worden' if failed else ''}.")
 
-    async def init_members(self, turn_context: TurnContext, session):
-        # Starting with adding members. Members are retrieved from a private google sheet.
-        await turn_context.send_activity("Gestart met het initialiseren van gebruikers via de google sheets...")
-        sheet_values = GoogleSheet().get_members()
+    async def get_team_members(self, turn_context: TurnContext):
         # Get members from teams
         continuation_token = None
         members = []
-        team_details = await TeamsInfo.get_team_details(turn_context)
-        team_id = team_details.id
 
         while True:
             paged_members = await TeamsInfo.get_paged_members(turn_context, continuation_token, 100)
@@ -242,64 +178,67 @@ class StickyADMINBot(TeamsActivityHandler):
 
             if continuation_token == None:
                 break
+        return members
 
-        # Double for loop which is sad... If you can come up with something better, let me know.
-        # For all members in the sheet...
+    # Members are retrieved from a private google sheet (sheet_values) and matched with the members of the team.
+    async def init_members(self, turn_context: TurnContext, session, sheet_values, members):
+        # Starting with adding members.
+        await turn_context.send_activity("Gestart met het initialiseren van gebruikers via de google sheets...")
+        start_time = time.monotonic()
+
+        # Index the team on email address, so every row in the sheet is matched with a single lookup.
+        members_by_email = {member.email.lower(): member for member in members if member.email}
+
+        # For every type in the sheet: (user type, database class, group ids by name, group column).
+        user_types = {'Intro': ('intro_user', db.IntroUser, None, None)}
+        mentor_groups = await db.getTable(session, db.MentorGroup)
+        user_types['Mentor'] = ('mentor_user', db.MentorUser, {group.name: group.mg_id for group in mentor_groups}, 'mg_id')
+        if self.alfas_bot: # These are only added when the alfas bot is launched.
+            committees = await db.getTable(session, db.Committee)
+            user_types['Commissie'] = ('committee_user', db.CommitteeUser,
+                                       {committee.name: committee.committee_id for committee in committees}, 'committee_id')
+        if self.uithof_bot: # These are only added when the uithof bot is launched.
+            locations = await db.getTable(session, db.USPLocation)
+            user_types['USP'] = ('usp_user', db.USPUser,
+                                 {location.name: location.location_id for location in locations}, 'location_id')
+
+        new_users = []
+        new_user_keys = set()
         not_existed_list = []
         not_added_list = []
-        for member in members:
-            print(member.email)
         for row in sheet_values[1:]:
             #get corresponding member
-            matching_member = next(filter(lambda member: member.email == row[2] or member.email == row[2].replace('students.', ''), members), None)
+            email = row[2].lower()
+            matching_member = members_by_email.get(email) or members_by_email.get(email.replace('students.', ''))
 
             if matching_member is None:
                 not_added_list.append(row[0] + " " + row[1])
                 continue
-            database_member = None
-
-            # Get from the database what member the member needs to become and save it as the right user.
-            if row[3] == "Intro":
-                user = db.getUserOnType(session, 'intro_user', helper.get_user_id(matching_member))
-                if not user:
-                    database_member = db.IntroUser(user_teams_id=helper.get_user_id(matching_member),
-                                                   user_name=matching_member.name)
-            elif row[3] == "Mentor":
-                user = db.getUserOnType(session, 'mentor_user', helper.get_user_id(matching_member))
-                if not user:
-                    mentor_group = db.getFirst(session, db.MentorGroup, 'name', row[4])
-                    if mentor_group:
-                        database_member = db.MentorUser(user_teams_id=helper.get_user_id(matching_member),
-                                                        user_name=matching_member.name,
-                                                        mg_id=mentor_group.mg_id)
-                    else:
-                        if row[4] not in not_existed_list:
-                            not_existed_list.append(row[4])
-            elif self.alfas_bot and row[3] == "Commissie": # These are only added when the alfas bot is launched.
-                user = db.getUserOnType(session, 'committee_user', helper.get_user_id(matching_member))
-                if not user:
-                    committee = db.getFirst(session, db.Committee, 'name', row[4])
-                    if committee:
-                        database_member = db.CommitteeUser(user_teams_id=helper.get_user_id(matching_member),
-                                                        user_name=matching_member.name,
-                                                        committee_id=committee.committee_id)
-                    else:
-                        if row[4] not in not_existed_list:
-                            not_existed_list.append(row[4])
-            elif self.uithof_bot and row[3] == "USP": # These are only added when the uithof bot is launched.
-                user = db.getUserOnType(session, 'usp_user', helper.get_user_id(matching_member))
-                if not user:
-                    location = db.getFirst(session, db.USPLocation, 'name', row[4])
-                    if location:
-                        database_member = db.USPUser(user_teams_id=helper.get_user_id(matching_member),
-                                                    user_name=matching_member.name,
-                                                    location_id=location.location_id)
-                    else:
-                        if row[4] not in not_existed_list:
-                            not_existed_list.append(row[4])
-            # Insert if a database_member is created (this is not the case if the user already exists in the database).
-            if database_member is not None:
-                db.dbInsert(session, database_member)
+
+            if row[3] not in user_types:
+                continue
+            user_type, user_class, group_ids, group_column = user_types[row[3]]
+            teams_id = helper.get_user_id(matching_member)
+
+            # Users that are already in the database (or earlier in the sheet) are skipped.
+            if role_index.get(teams_id, user_type) or (teams_id, user_type) in new_user_keys:
+                continue
+
+            user_values = {'user_teams_id': teams_id, 'user_name': matching_member.name}
+            if group_column:
+                if row[4] not in group_ids:
+                    if row[4] not in not_existed_list:
+                        not_existed_list.append(row[4])
+                    continue
+                user_values[group_column] = group_ids[row[4]]
+
+            new_users.append(user_class(**user_values))
+            new_user_keys.add((teams_id, user_type))
+
+        # All new users are inserted in one transaction.
+        await db.dbInsertAll(session, new_users)
+        for new_user in new_users:
+            role_index.put(new_user)
 
         if not_existed_list:
             await turn_context.send_activity("De volgende groepen bestaan niet: " + ", ".join(not_existed_list))
@@ -307,40 +246,39 @@ class StickyADMINBot(TeamsActivityHandler):
             await turn_context.send_activity("De volgende personen zijn niet aan het team toegevoegd: " + ", ".join(not_added_list))
         else:
             await turn_context.send_activity("Alle gebruikers zijn toegevoegd met bijbehorende rechten.")
+        await turn_context.send_activity(f"{len(sheet_values) - 1} rijen verwerkt en {len(new_users)} nieuwe gebruikers toegevoegd "
+                                         f"in {time.monotonic() - start_time:.1f} seconden.")
 
-    async def init_timeslots(self, turn_context: TurnContext, session):
-        # Obtain timeslots sheet
+    # The timeslots are retrieved from the timeslots sheet (sheet_values).
+    async def init_timeslots(self, turn_context: TurnContext, session, sheet_values):
         await turn_context.send_activity("Gestart met het ophalen van verenigingstijdsloten voor de mentorgroepen...")
-        sheet_values = GoogleSheet().get_timeslots()
-        
-        # For simplicity, we rebuild the whole scheduler if there are jobs already present.
-        if self.alfas_bot.jobs:
-            self.alfas_bot.jobs.clear()
-            self.alfas_bot.scheduler.remove_all_jobs()
 
-        not_existing_groups = []
-        for row in sheet_values[1:]:
-            mentor_group = db.getFirst(session, db.MentorGroup, 'name', row[0])
-
-            if mentor_group:
-                for idx, association in enumerate(self.CONFIG.ASSOCIATIONS):
-                    try:
-                        time_hours = int(row[idx+1].split(':')[0])
-                        time_minutes = int(row[idx+1].split(':')[1])
-                    except ValueError:
-                        await turn_context.send_activity("De tijdsloten in de google sheet zijn niet goed geformateerd.")
-                        return
-                    setattr(mentor_group, f'{association}_timeslot', datetime.time(time_hours, time_minutes, 0, 0))
-                db.dbMerge(session, mentor_group)
-            
+        # The whole sheet is parsed before anything is saved, so a badly formatted timeslot
+        # changes none of the timeslots and the reminders stay as they were.
+        timeslots = []
+        try:
+            for row in sheet_values[1:]:
+                times = {}
                 for idx, association in enumerate(self.CONFIG.ASSOCIATIONS):
-                    result_jobs = self.create_job(turn_context, mentor_group.channel_id, row[idx+1], association)
-                    if association in self.alfas_bot.jobs.keys():
-                        self.alfas_bot.jobs[association].extend(result_jobs)
-                    else:
-                        self.alfas_bot.jobs.update({association: result_jobs})
-            else:
-                not_existing_groups.append(row[0])
+                    time_hours = int(row[idx+1].split(':')[0])
+                    time_minutes = int(row[idx+1].split(':')[1])
+                    times[association] = datetime.time(time_hours, time_minutes, 0, 0)
+                timeslots.append((row[0], times))
+        except (ValueError, IndexError):
+            await turn_context.send_activity("De tijdsloten in de google sheet zijn niet goed geformateerd.")
+            return
+
+        # All timeslots are saved in one transaction.
+        mentor_groups, not_existing_groups = await db.setTimeslots(session, timeslots)
+        timeslot_reminders = []
+        for mentor_group in mentor_groups:
+            for association in self.CONFIG.ASSOCIATIONS:
+                time = getattr(mentor_group, f'{association}_timeslot')
+                timeslot_reminders.extend(self.create_reminders(mentor_group, f'{time.hour:02}:{time.minute:02}', association))
+
+        # For simplicity, we rebuild all reminders.
+        await self.alfas_bot.reminders.remove()
+        await self.schedule_reminders(turn_context, timeslot_reminders)
 
         if not self.alfas_bot.scheduler.running:
             self.alfas_bot.scheduler.start()
@@ -350,29 +288,39 @@ class StickyADMINBot(TeamsActivityHandler):
         else:
             await turn_context.send_activity("Alle tijdsloten zijn toegevoegd!")
     
-    async def restart_scheduler(self, turn_context, session):
-        mentor_groups = db.getTable(session, db.MentorGroup)
+    async def restart_scheduler(self, turn_context):
+        session = db.Session()
+        mentor_groups = await db.getTable(session, db.MentorGroup)
+        session.close()
 
-        #Remove all jobs if there are any present.
-        if self.alfas_bot.jobs:
-            self.alfas_bot.jobs.clear()
-            self.alfas_bot.scheduler.remove_all_jobs()
+        #Remove all reminders if there are any present.
+        await self.alfas_bot.reminders.remove()
 
+        timeslot_reminders = []
         for mentor_group in mentor_groups:
             for _, association in enumerate(self.CONFIG.ASSOCIATIONS):
                 time = getattr(mentor_group, f'{association}_timeslot')
-                result_jobs = self.create_job(turn_context, mentor_group.channel_id, f'{time.hour}:{time.minute}', association)
-                if association in self.alfas_bot.jobs.keys():
-                    self.alfas_bot.jobs[association].extend(result_jobs)
-                else:
-                    self.alfas_bot.jobs.update({association: result_jobs})
-        
+                if time:
+                    timeslot_reminders.extend(self.create_reminders(mentor_group, f'{time.hour:02}:{time.minute:02}', association))
+        await self.schedule_reminders(turn_context, timeslot_reminders)
+
         if not self.alfas_bot.scheduler.running:
             self.alfas_bot.scheduler.start()
-        
-        print(self.alfas_bot.jobs)
-        
+
         await turn_context.send_activity("Scheduler has restarted")
+        await self.reminder_status(turn_context)
+
+    async def reminder_status(self, turn_context: TurnContext):
+        stats = await self.alfas_bot.reminders.stats()
+        text = f"{stats['reminders']} herinneringen in {stats['jobs']} geplande taken."
+        for fire_time, channels, failed, duration in stats['fan_outs'][-10:]:
+            text += f"  \n{fire_time:%H:%M}: {channels} kanalen ({failed} mislukt) in {duration:.2f} seconden"
+        await turn_context.send_activity(text)
+
+    async def flush_sheet_cache(self, turn_context: TurnContext):
+        sheet = await get_sheet()
+        await sheet.flush_cache()
+        await turn_context.send_activity("De sheet cache is geleegd. De sheets worden bij het volgende gebruik opnieuw gedownload.")
 
     # Function to start adding a seperate committee. Expects argument: committee_name
     async def add_committee(self, turn_context: TurnContext):
@@ -414,13 +362,13 @@ class StickyADMINBot(TeamsActivityHandler):
 
         #Save or update the new committee
         session = db.Session()
-        existing_committee = db.getFirst(session, db.Committee, 'name', committee_name)        
+        existing_committee = await db.getFirst(session, db.Committee, 'name', committee_name)        
         if existing_committee:
             existing_committee.channel_id = channel_id
-            db.dbMerge(session, existing_committee)
+            await db.dbMerge(session, existing_committee)
         else:
             committee = db.Committee(name=committee_name, info="", channel_id=channel_id)
-            db.dbInsert(session, committee)
+            await db.dbInsert(session, committee)
         session.close()
         await turn_context.send_activity(f"De commissie '{committee_name}' is succesvol toegevoegd!")
 
@@ -460,13 +408,13 @@ class StickyADMINBot(TeamsActivityHandler):
             return
 
         session = db.Session()
-        existing_mentor_group = db.getFirst(session, db.MentorGroup, 'name', mentor_group_name)
+        existing_mentor_group = await db.getFirst(session, db.MentorGroup, 'name', mentor_group_name)
         if existing_mentor_group:
             existing_mentor_group.channel_id = channel_id
-            db.dbMerge(session, existing_mentor_group)
+            await db.dbMerge(session, existing_mentor_group)
         else:
             mentor_group = db.MentorGroup(name=mentor_group_name, channel_id=channel_id)
-            db.dbInsert(session, mentor_group)
+            await db.dbInsert(session, mentor_group)
         await turn_context.send_activity(f"Mentorgroep '{mentor_group_name}' is succesvol toegevoegd!")
         session.close()
     
@@ -506,13 +454,13 @@ class StickyADMINBot(TeamsActivityHandler):
             return
 
         session = db.Session()
-        existing_USP_location = db.getFirst(session, db.USPLocation, 'name', USP_location_name)
+        existing_USP_location = await db.getFirst(session, db.USPLocation, 'name', USP_location_name)
         if existing_USP_location:
             existing_USP_location.channel_id = channel_id
-            db.dbMerge(session, existing_USP_location)
+            await db.dbMerge(session, existing_USP_location)
         else:
             USP_location = db.USPLocation(name=USP_location_name, channel_id=channel_id)
-            db.dbInsert(session, USP_location)
+            await db.dbInsert(session, USP_location)
         await turn_context.send_activity(f"USP locatie '{USP_location_name}' is succesvol toegevoegd!")
         session.close()
 
@@ -525,11 +473,12 @@ class StickyADMINBot(TeamsActivityHandler):
 
         if intro_password == self.CONFIG.INTRO_PASSWORD:
             session = db.Session()
-            sender = await TeamsInfo.get_member(turn_context, turn_context.activity.from_property.id)
-            existing_user = db.getUserOnType(session, 'intro_user', sender.id)
+            sender = await helper.get_member(turn_context)
+            existing_user = role_index.get(helper.get_user_id(sender), 'intro_user')
             if not existing_user:
                 new_user = db.IntroUser(user_teams_id=helper.get_user_id(sender), user_name=sender.name)
-                db.dbInsert(session, new_user)
+                await db.dbInsert(session, new_user)
+                role_index.put(new_user)
                 await turn_context.send_activity("Je bent succesvol geregistreerd als Intro")
             else:
                 await turn_context.send_activity("Je bent al geregistreerd als Intro!")
@@ -549,22 +498,24 @@ class StickyADMINBot(TeamsActivityHandler):
 
         if mentor_password == self.CONFIG.MENTOR_PASSWORD:
             session = db.Session()
-            sender = await TeamsInfo.get_member(turn_context, turn_context.activity.from_property.id)
-            mentor_group = db.getFirst(session, db.MentorGroup, 'name', mentor_group_name)
-            existing_user = db.getUserOnType(session, 'mentor_user', helper.get_user_id(sender))
+            sender = await helper.get_member(turn_context)
+            mentor_group = await db.getFirst(session, db.MentorGroup, 'name', mentor_group_name)
+            existing_user = await db.getUserOnType(session, 'mentor_user', helper.get_user_id(sender))
 
             if not existing_user:
                 if mentor_group:
                     new_user = db.MentorUser(user_teams_id=helper.get_user_id(sender),
                                             user_name=sender.name,
                                             mg_id=mentor_group.mg_id)
-                    db.dbInsert(session, new_user)
+                    await db.dbInsert(session, new_user)
+                    role_index.put(new_user)
                     await turn_context.send_activity(f"Je bent succesvol geregistreerd als een Mentor voor groep: '{mentor_group_name}''")
                 else:
                     await turn_context.send_activity('Deze mentorgroep bestaat nog niet! Contacteer een Introlid als je vindt dat dit niet klopt.')
             else:
                 existing_user.mg_id = mentor_group.mg_id
-                db.dbMerge(session, existing_user)
+                await db.dbMerge(session, existing_user)
+                role_index.put(existing_user)
                 await turn_context.send_activity(f"Mentor '{sender.name}' is succesvol bijgewerkt!")
             session.close()
         else:
@@ -582,112 +533,128 @@ class StickyADMINBot(TeamsActivityHandler):
 
         if committee_password == self.CONFIG.COMMITTEE_PASSWORD:
             session = db.Session()
-            sender = await TeamsInfo.get_member(turn_context, turn_context.activity.from_property.id)
-            committee = db.getFirst(session, db.Committee, 'name', committee_name)
-            existing_user = db.getUserOnType(session, 'committee_user', helper.get_user_id(sender))
+            sender = await helper.get_member(turn_context)
+            committee = await db.getFirst(session, db.Committee, 'name', committee_name)
+            existing_user = await db.getUserOnType(session, 'committee_user', helper.get_user_id(sender))
 
             if not existing_user:
                 if committee:
                     new_user = db.CommitteeUser(user_teams_id=helper.get_user_id(sender),
                                                 user_name=sender.name,
                                                 committee_id=committee.committee_id)
-                    db.dbInsert(session, new_user)
+                    await db.dbInsert(session, new_user)
+                    role_index.put(new_user)
                     await turn_context.send_activity(f"Je bent succesvol geregistreerd als een Commissielid van '{committee_name}'")
                 else:
                     await turn_context.send_activity('Deze commissie bestaat nog niet! Contacteer een Introlid als je vindt dat dit niet klopt.')
             else:
                 existing_user.committee_id = committee.committee_id
-                db.dbMerge(session, existing_user)
+                await db.dbMerge(session, existing_user)
+                role_index.put(existing_user)
                 await turn_context.send_activity(f"Commissielid '{sender.name}' is succesvol bijgewerkt")
             session.close()
         else:
             await turn_context.send_activity('Verkeerd wachtwoord!')
 
     async def user_info(self, turn_context: TurnContext):
-        user = await TeamsInfo.get_member(turn_context, turn_context.activity.from_property.id)
+        user = await helper.get_member(turn_context)
 
-        session = db.Session()
-        users = db.getAll(session, db.User, 'user_teams_id', helper.get_user_id(user))
+        users = role_index.roles(helper.get_user_id(user))
 
         if not users:
             await turn_context.send_activity("Je bent niet als een speciale gebruiker bij de bot geregistreerd!")
-            session.close()
             return
         
+        session = db.Session()
         return_string = "Je bent als volgt bij de bot bekend:   \n"
         for user in users:
             if user.user_type == "intro_user":
                 return_string += f'- Introlid   \n'
             elif user.user_type == "mentor_user":
-                mentor_user = db.getUserOnType(session, 'mentor_user', user.user_teams_id)
-                mentor_group = db.getFirst(session, db.MentorGroup, 'mg_id', mentor_user.mg_id)
+                mentor_group = await db.getFirst(session, db.MentorGroup, 'mg_id', user.mg_id)
                 return_string += f'- Mentor voor groep {mentor_group.name}   \n'
             elif user.user_type == "committee_user":
-                committee_user = db.getUserOnType(session, 'committee_user', user.user_teams_id)
-                committee = db.getFirst(session, db.Committee, 'committee_id', committee_user.committee_id)
+                committee = await db.getFirst(session, db.Committee, 'committee_id', user.committee_id)
                 return_string += f'- Commissielid voor {committee.name}   \n'
             elif user.user_type == "usp_user":
-                location_user = db.getUserOnType(session, 'usp_user', user.user_teams_id)
-                location = db.getFirst(session, db.USPLocation, 'location_id', location_user.location_id)
+                location = await db.getFirst(session, db.USPLocation, 'location_id', user.location_id)
                 return_string += f'- USP helper voor {location.name}    \n'
         session.close()
         await turn_context.send_activity(return_string)
 
-    async def unlock_bot(self, turn_context: TurnContext):
+    async def broadcast_command(self, turn_context: TurnContext):
+        command_info = turn_context.activity.text.split(maxsplit=2)
+        broadcast_tables = {'mentorgroepen': db.MentorGroup, 'commissies': db.Committee, 'usp': db.USPLocation}
 
-        try:
-            bot = turn_context.activity.text.split()[1]
-        except IndexError:
-            await turn_context.send_activity("Je moet specificeren welke bot je wilt activeren: Activeer <'alfas', 'c88' of 'uithof'>")
-        
-        if bot == 'alfas' and self.alfas_bot:
-            self.alfas_bot.unlocked = True
-        elif bot == 'uithof' and self.uithof_bot:
-            self.uithof_bot.unlocked = True
-        else:
-            await turn_context.send_activity("Deze bot is niet bekend bij de ADMINbot of is niet gestart.")
+        if len(command_info) < 3 or command_info[1].lower() not in broadcast_tables:
+            await turn_context.send_activity("Het commando moet als volgt gespecificeerd worden: Omroepen <mentorgroepen, commissies of usp> <bericht>")
             return
-        
-        await turn_context.send_activity("De bot is succesvol geactiveerd!")
+
+        succeeded, failed, duration = await self.broadcast(turn_context, broadcast_tables[command_info[1].lower()], command_info[2])
+        await turn_context.send_activity(f"Het bericht is in {duration:.1f} seconden naar {succeeded} kanalen verstuurd"
+                                         f"{f', {failed} kanalen hebben het niet ontvangen' if failed else ''}.")
+
+    # Sends one message to the channels of all rows in table (MentorGroup, Committee or USPLocation) concurrently.
+    # Returns (succeeded, failed, duration in seconds).
+    async def broadcast(self, turn_context: TurnContext, table, text: str):
+        start_time = time.monotonic()
+        session = db.Session()
+        groups = await db.getTable(session, table)
+        session.close()
+
+        channel_messages = [(group.channel_id, MessageFactory.text(text)) for group in groups if group.channel_id]
+        succeeded, failed = await helper.create_channel_conversations(turn_context, channel_messages, outbound.NORMAL)
+        return succeeded, failed, time.monotonic() - start_time
+
+    async def unlock_bot(self, turn_context: TurnContext):
+        if await self.set_bot_unlocked(turn_context, turn_context.activity.text.split()[1], True):
+            await turn_context.send_activity("De bot is succesvol geactiveerd!")
 
     async def lock_bot(self, turn_context: TurnContext):
+        if await self.set_bot_unlocked(turn_context, turn_context.activity.text.split()[1], False):
+            await turn_context.send_activity("De bot is succesvol gedeactiveerd!")
+
+    # The lock state is stored in the database, so every worker process applies it.
+    async def set_bot_unlocked(self, turn_context: TurnContext, bot, unlocked):
+        name = bot.upper()
+        bot_object = self.bots.get(name)
+        if not bot_object:
+            await turn_context.send_activity("Deze bot is niet bekend bij de ADMINbot of is niet gestart. "
+                                             f"Gestart zijn: {', '.join(name.lower() for name in self.bots)}.")
+            return False
 
-        try:
-            bot = turn_context.activity.text.split()[1]
-        except IndexError:
-            await turn_context.send_activity("Je moet specificeren welke bot je wilt deactiveren: Activeer <'alfas', 'c88' of 'uithof'>")
-        
-        if bot == 'alfas' and self.alfas_bot:
-            self.alfas_bot.unlocked = False
-        elif bot == 'uithof' and self.uithof_bot:
-            self.uithof_bot.unlocked = False
-        else:
-            await turn_context.send_activity("Deze bot is niet bekend bij de ADMINbot of is niet gestart.")
-            return
-        
-        await turn_context.send_activity("De bot is succesvol geactiveerd!")
-    
-    ### Local helper methods!!!
+        session = db.Session()
+        await db.setBotUnlocked(session, name, unlocked)
+        session.close()
+        bot_object.unlocked = unlocked
+        return True
+
+    # Number of calls and latency of the commands of all bots, most used first.
+    async def command_stats(self, turn_context: TurnContext):
+        text = ""
+        for name, router in commands.routers.items():
+            for command, (calls, total, slowest) in sorted(router.stats.items(), key=lambda item: -item[1][0]):
+                text += f"{name} {command}: {calls}x, gemiddeld {total / calls * 1000:.0f} ms, max {slowest * 1000:.0f} ms  \n"
+        await turn_context.send_activity(text or "Er zijn nog geen commando's uitgevoerd.")
 
-    async def send_reminder(self, turn_context: TurnContext, minutes, channel_id, association):
-        message = MessageFactory.text(f"Herinnering! De inschrijfbalie van {association} zal jullie groep bezoeken over {minutes} minuten.")
-        await helper.create_channel_conversation(turn_context, channel_id, message)
+    ### Local helper methods!!!
 
     def string_to_datetime(self, time: str):
         hour, minute = int(time[:2]), int(time[3:])
         time = datetime.datetime(2020, 1, 1, hour, minute, 0, 0)
         return time
     
-    def create_job(self, turn_context: TurnContext, channel_id, string_time: str, association):
+    # The reminders 5 and 1 minutes before the timeslot, as (fire time, target) for the reminder engine.
+    def create_reminders(self, mentor_group, string_time: str, association):
         time = self.string_to_datetime(string_time)
-        time_5 = time - datetime.timedelta(minutes=5)
-        time_1 = time - datetime.timedelta(minutes=1)
-        one_job = self.alfas_bot.scheduler.add_job(self.send_reminder, args=[turn_context, 1, channel_id, association],
-                                        trigger='cron', year=self.CONFIG.ALFAS_DATE.year,
-                                        month=self.CONFIG.ALFAS_DATE.month, day=self.CONFIG.ALFAS_DATE.day,
-                                        hour=time_1.hour, minute=time_1.minute)
-        five_job = self.alfas_bot.scheduler.add_job(self.send_reminder, args=[turn_context, 5, channel_id, association],
-                                        trigger='cron', year=self.CONFIG.ALFAS_DATE.year,
-                                        month=self.CONFIG.ALFAS_DATE.month, day=self.CONFIG.ALFAS_DATE.day,
-                                        hour=time_5.hour, minute=time_5.minute)
-        return [one_job, five_job]
\ No newline at end of file
+        time = datetime.datetime.combine(self.CONFIG.ALFAS_DATE, time.time())
+        return [(time - datetime.timedelta(minutes=minutes),
+                 {'channel_id': mentor_group.channel_id, 'mg_id': mentor_group.mg_id,
+                  'association': association, 'minutes': minutes})
+                for minutes in [1, 5]]
+
+    # The reminders are stored in the database with a serializable conversation reference,
+    # so they survive a restart of the bot. Reminders at the same time share one job.
+    async def schedule_reminders(self, turn_context: TurnContext, timeslot_reminders):
+        conversation_reference = TurnContext.get_conversation_reference(turn_context.activity).serialize()
+        await self.alfas_bot.reminders.schedule(self._app_id, conversation_reference, timeslot_reminders)
@@ -1,9 +1,12 @@
 from botbuilder.core import CardFactory, TurnContext, MessageFactory
-from botbuilder.core.teams import TeamsActivityHandler, TeamsInfo
+from botbuilder.core.teams import TeamsActivityHandler
 from botbuilder.schema import CardAction, HeroCard, Mention, ConversationParameters
 from botbuilder.schema._connector_client_enums import ActionTypes
 import modules.database as db
 import modules.helper_funtions as helper
+from modules import outbound
+from modules.commands import Command, CommandRouter, check_user_type
+from modules.role_index import role_index
 from config import DefaultConfig
     
 class StickyUITHOFBot(TeamsActivityHandler):
@@ -13,6 +16,27 @@ class StickyUITHOFBot(TeamsActivityHandler):
         self.CONFIG = DefaultConfig()
         self.unlocked = True
 
+    COMMANDS = CommandRouter('UITHOF', [
+        #accept the group
+        Command("Accept", 'accept', min_args=1, max_args=1, role='usp_user',
+                usage="Iets ging fout met het krijgen van de mentorgroep. Neem a.u.b contact op met de intro-commissie"),
+        # Return all locations that are available at this moment
+        Command("BeschikbareLocaties", 'available_locations', role=('mentor_user', 'intro_user')),
+        # Choose a locations for a mentor group to visit.
+        Command("ChooseLocation", 'choose_location', min_args=1, max_args=1, role='mentor_user',
+                usage="Iets ging fout met het krijgen van de locatie. Neem a.u.b contact op met de intro-commissie"),
+    ], "We kennen dit commando niet. Misschien een typo?")
+
+    # Sent by check_role when the sender does not have the role of a command.
+    ROLE_REFUSALS = {
+        'usp_user': "Alleen usp helpers kunnen dit doen",
+        ('mentor_user', 'intro_user'): "Alleen een Mentor kan dit doen",
+        'mentor_user': "Alleen een mentor mag dit uitvoeren.",
+    }
+
+    async def check_role(self, turn_context: TurnContext, role):
+        return await check_user_type(turn_context, role, self.ROLE_REFUSALS)
+
     async def on_message_activity(self, turn_context: TurnContext):
         if not self.unlocked:
             await turn_context.send_activity("De bot is geblokkeerd en kan dus niet gebruikt worden. Probeer later opnieuw of vraag een admin om de bot vrij te geven.")
@@ -21,41 +45,25 @@ class StickyUITHOFBot(TeamsActivityHandler):
         TurnContext.remove_recipient_mention(turn_context.activity)
         turn_context.activity.text = turn_context.activity.text.strip()
 
-        #accept the group
-        if turn_context.activity.text.startswith("Accept"):
-            await self.accept(turn_context)
-            return
-
-        # Return all locations that are available at this moment
-        if turn_context.activity.text == "BeschikbareLocaties":
-            await self.available_locations(turn_context)
-            return
+        await self.COMMANDS.dispatch(self, turn_context)
 
-        # Choose a locations for a mentor group to visit.
-        if turn_context.activity.text.startswith("ChooseLocation"):
-            await self.choose_location(turn_context)
-            return
+    async def on_teams_members_added(self, teams_members_added, team_info, turn_context: TurnContext):
+        helper.invalidate_members(teams_members_added)
+        return await super().on_teams_members_added(teams_members_added, team_info, turn_context)
 
-        await turn_context.send_activity("We kennen dit commando niet. Misschien een typo?")
-        return
+    async def on_teams_members_removed(self, teams_members_removed, team_info, turn_context: TurnContext):
+        helper.invalidate_members(teams_members_removed)
+        return await super().on_teams_members_removed(teams_members_removed, team_info, turn_context)
 
     async def available_locations(self, turn_context: TurnContext):
         channel_id = turn_context.activity.channel_data['teamsChannelId']
         session = db.Session()
-        if not db.getFirst(session, db.MentorGroup, 'channel_id', channel_id):
+        if not await db.getFirst(session, db.MentorGroup, 'channel_id', channel_id):
             await turn_context.send_activity("Dit kan alleen gedaan worden vanuit een mentorgroep kanaal")
             session.close()
             return
 
-        user = await TeamsInfo.get_member(turn_context, turn_context.activity.from_property.id)
-        mentor_db_user = db.getUserOnType(session, 'mentor_user', helper.get_user_id(user))
-        intro_db_user = db.getUserOnType(session, 'intro_user', helper.get_user_id(user))
-        if (not mentor_db_user and not intro_db_user):
-            await turn_context.send_activity("Alleen een Mentor kan dit doen")
-            session.close()
-            return
-
-        locations = session.query(db.USPLocation).all()
+        locations = await db.getTable(session, db.USPLocation)
 
         card = CardFactory.hero_card(
             HeroCard(
@@ -76,47 +84,25 @@ class StickyUITHOFBot(TeamsActivityHandler):
 
     async def choose_location(self, turn_context: TurnContext):
         #Get user from teams and database
-        user = await TeamsInfo.get_member(turn_context, turn_context.activity.from_property.id)
+        user = await helper.get_member(turn_context)
         session = db.Session()
-        db_user = db.getUserOnType(session, 'mentor_user', helper.get_user_id(user))
-    
-        #If exists in database...
-        if db_user:
-            # Check if command is correct
-            try:
-                location_name = turn_context.activity.text.split()[1]
-            except IndexError:
-                await turn_context.send_activity("Iets ging fout met het krijgen van de locatie. Neem a.u.b contact op met de intro-commissie")
-
-            mentor_group = db.getFirst(session, db.MentorGroup, 'mg_id', db_user.mg_id)
-            if mentor_group.occupied:
-                await turn_context.send_activity("Je staat al in een queue!")
-                session.close()
-                return
-
-            location = db.getFirst(session, db.USPLocation, 'name', location_name)
-
-            # If location is not occupied
-            if not location.occupied:
-                # Immediately set it as occupied, then do the rest (to make it atomic)
-                location.occupied = True
-                mentor_group.occupied = True
-                db.dbMerge(session, location)
-                db.dbMerge(session, mentor_group)
-                # Get mentor group and create a visit.
-                visit = db.USPVisit(mg_id=mentor_group.mg_id, location_id=location.location_id)
-                db.dbInsert(session, visit)
-                await turn_context.send_activity(f"Je staat in de wachtlijst van: '{location.name}'")
-                accept_button = await self.create_accept_button(mentor_group)
-                await helper.create_channel_conversation(turn_context, location.channel_id, accept_button)
-            else:
-                mentor_group.occupation = True
-                db.dbMerge(session, mentor_group)
-                visit = db.USPVisit(mg_id=mentor_group.mg_id, location_id=location.location_id)
-                db.dbInsert(session, visit)
-                await turn_context.send_activity(f"Je staat in de wachtlijst van: '{location.name}'")
-        else:
-            await turn_context.send_activity(f"Alleen een mentor mag dit uitvoeren.")
+        db_user = role_index.get(helper.get_user_id(user), 'mentor_user')
+        location_name = turn_context.activity.text.split()[1]
+
+        mentor_group = await db.getFirst(session, db.MentorGroup, 'mg_id', db_user.mg_id)
+        if mentor_group.occupied:
+            await turn_context.send_activity("Je staat al in een queue!")
+            session.close()
+            return
+
+        location = await db.getFirst(session, db.USPLocation, 'name', location_name)
+
+        # The visit is created in one transaction, which also occupies both when the location is free.
+        location_was_free = await db.addUSPVisit(session, mentor_group, location)
+        await turn_context.send_activity(f"Je staat in de wachtlijst van: '{location.name}'")
+        if location_was_free:
+            accept_button = await self.create_accept_button(mentor_group)
+            await helper.create_channel_conversation(turn_context, location.channel_id, accept_button, outbound.HIGH)
         session.close()
 
     async def create_accept_button(self, mentor_group):
@@ -137,42 +123,29 @@ class StickyUITHOFBot(TeamsActivityHandler):
         return MessageFactory.attachment(card)
 
     async def accept(self, turn_context: TurnContext):
-        user = await TeamsInfo.get_member(turn_context, turn_context.activity.from_property.id)
+        mentor_group_name = turn_context.activity.text.split()[1]
         session = db.Session()
-        db_user = db.getUserOnType(session, 'usp_user', helper.get_user_id(user))
-
-        # Check if command is correct
-        if db_user:
-            try:
-                mentor_group_name = turn_context.activity.text.split()[1]
-            except IndexError:
-                await turn_context.send_activity("Iets ging fout met het krijgen van de locatie. Neem a.u.b contact op met de intro-commissie")
-
-            mentor_group = db.getFirst(session, db.MentorGroup, 'name', mentor_group_name)
-            old_visit = db.getFirst(session, db.USPVisit, 'mg_id', mentor_group.mg_id)
-            if(old_visit):
-                location = db.getFirst(session, db.USPLocation, 'location_id', old_visit.location_id)
-                accept_message = MessageFactory.text(f"{location.name} komt nu naar je toe")
-                await helper.create_channel_conversation(turn_context, mentor_group.channel_id, accept_message)
-                await turn_context.send_activity(f"Je kan nu naar mentorgroep: {mentor_group_name} gaan")
-
-                old_mentor_group = db.getFirst(session, db.MentorGroup, 'mg_id', old_visit.mg_id)
-                location_id = old_visit.location_id
-                old_mentor_group.occupied = False
-                db.dbMerge(session, old_mentor_group)
-                session.delete(old_visit)
-                session.commit()
-                await self.update_accept_card(turn_context, location_id)
-            else:
-                await turn_context.send_activity("Ging iets fout met het verwijderen van de laatste visit")
+
+        mentor_group = await db.getFirst(session, db.MentorGroup, 'name', mentor_group_name)
+        old_visit = await db.getFirst(session, db.USPVisit, 'mg_id', mentor_group.mg_id)
+        if(old_visit):
+            location = await db.getFirst(session, db.USPLocation, 'location_id', old_visit.location_id)
+            accept_message = MessageFactory.text(f"{location.name} komt nu naar je toe")
+            await helper.create_channel_conversation(turn_context, mentor_group.channel_id, accept_message, outbound.HIGH)
+            await turn_context.send_activity(f"Je kan nu naar mentorgroep: {mentor_group_name} gaan")
+
+            old_mentor_group = await db.getFirst(session, db.MentorGroup, 'mg_id', old_visit.mg_id)
+            location_id = old_visit.location_id
+            await db.finishUSPVisit(session, old_visit, old_mentor_group)
+            await self.update_accept_card(turn_context, location_id)
         else:
-            await turn_context.send_activity("Aleen usp helpers kunnen dit doen")
+            await turn_context.send_activity("Ging iets fout met het verwijderen van de laatste visit")
         session.close()
 
     async def update_accept_card(self, turn_context: TurnContext, location):
         session = db.Session()
         
-        mentor_groups = db.getAll(session, db.USPVisit, 'location_id', location)
+        mentor_groups = await db.getAll(session, db.USPVisit, 'location_id', location)
 
         if mentor_groups:
             card = CardFactory.hero_card(
@@ -194,10 +167,10 @@ class StickyUITHOFBot(TeamsActivityHandler):
             updated_card.id = turn_context.activity.reply_to_id
             await turn_context.update_activity(updated_card)
         else:
-            current_location = db.getFirst(session, db.USPLocation, 'location_id', location)
+            current_location = await db.getFirst(session, db.USPLocation, 'location_id', location)
             if(current_location):
                 current_location.occupied = False
-                db.dbMerge(session, current_location)
+                await db.dbMerge(session, current_location)
                 session.close()
                 await turn_context.delete_activity(turn_context.activity.reply_to_id)
             else:
@@ -33,6 +33,19 @@ class DefaultConfig:
     ALFAS_ENROLLMENTS_RANGE = os.getenv("ALFASEnrollmentsRange")
     CRAZY88_QUESTION_RANGE = os.getenv("Crazy88QuestionRage")
 
+    # Number of threads that run the blocking Google Sheets requests.
+    GOOGLE_SHEETS_WORKERS = int(os.getenv("GoogleSheetsWorkers", "4"))
+    # The Google access token is refreshed when it expires within this many seconds.
+    GOOGLE_TOKEN_REFRESH_MARGIN = int(os.getenv("GoogleTokenRefreshMargin", "300"))
+    # Downloaded sheet ranges are kept here until the spreadsheet changes.
+    GOOGLE_SHEETS_CACHE = os.getenv("GoogleSheetsCache", "data/sheet_cache.json")
+
+    # New enrollments are exported to the sheet per this many, or this many seconds after the first one.
+    ENROLLMENT_SYNC_BATCH_SIZE = int(os.getenv("EnrollmentSyncBatchSize", "25"))
+    ENROLLMENT_SYNC_INTERVAL = int(os.getenv("EnrollmentSyncInterval", "30"))
+    # Longest wait in seconds between retries when the Google quota is exceeded.
+    ENROLLMENT_SYNC_MAX_BACKOFF = int(os.getenv("EnrollmentSyncMaxBackoff", "300"))
+
     MAIN_ADMIN = ["Niels Kwadijk", "Joris de Jong", "Merijn Stiekema"]
 
     ASSOCIATIONS = ["Sticky", "Aeskwadraat"]
@@ -40,3 +53,40 @@ class DefaultConfig:
     ALFAS_DATE = datetime.date(2020, 9, 3) # year, month, day
 
     TIME_ZONE = os.getenv("TimeZone")
+
+    # Reminders that could not be sent on time (e.g. during a restart) are still sent within this many seconds.
+    REMINDER_MISFIRE_GRACE_TIME = int(os.getenv("ReminderMisfireGraceTime", "60"))
+    # Reminders that fire at the same time are sent to at most this many channels at once.
+    REMINDER_FANOUT_PARALLELISM = int(os.getenv("ReminderFanoutParallelism", "10"))
+
+    # Open committee cards are updated this many seconds after a claim or release, at most this many per channel.
+    COMMITTEE_CARD_DEBOUNCE = float(os.getenv("CommitteeCardDebounce", "1"))
+    COMMITTEE_CARD_MAX_PER_CHANNEL = int(os.getenv("CommitteeCardMaxPerChannel", "3"))
+
+    # Number of aiohttp worker processes that share the port. They share their runtime state through the database:
+    # it is synced every SHARED_STATE_INTERVAL seconds and the scheduler runs in the worker that holds its lease.
+    WORKERS = int(os.getenv("Workers", "1"))
+    SHARED_STATE_INTERVAL = float(os.getenv("SharedStateInterval", "5"))
+    SCHEDULER_LEASE = float(os.getenv("SchedulerLease", "15")) # seconds, longer than SHARED_STATE_INTERVAL
+
+    # Number of threads that run the blocking database queries next to the event loop.
+    DATABASE_WORKERS = int(os.getenv("DatabaseWorkers", "4"))
+
+    # SQLite engine profile, applied to every new database connection.
+    DATABASE_JOURNAL_MODE = os.getenv("DatabaseJournalMode", "WAL")
+    DATABASE_SYNCHRONOUS = os.getenv("DatabaseSynchronous", "NORMAL")
+    DATABASE_BUSY_TIMEOUT = int(os.getenv("DatabaseBusyTimeout", "5000")) # milliseconds
+    DATABASE_MMAP_SIZE = int(os.getenv("DatabaseMmapSize", str(256 * 1024 * 1024))) # bytes
+    # Idle connections that are kept open. More connections are opened when needed, a session never waits for one.
+    DATABASE_POOL_SIZE = int(os.getenv("DatabasePoolSize", "10"))
+
+    # Teams members that send commands are cached for this many seconds, up to this many members.
+    MEMBER_CACHE_TTL = int(os.getenv("MemberCacheTTL", "600"))
+    MEMBER_CACHE_SIZE = int(os.getenv("MemberCacheSize", "5000"))
+
+    # Proactive messages are sent by this many workers, throttled messages are retried this many times.
+    OUTBOUND_WORKERS = int(os.getenv("OutboundWorkers", "8"))
+    OUTBOUND_RETRIES = int(os.getenv("OutboundRetries", "3"))
+    # Messages per second for all proactive messages together and per conversation (Teams throttles both).
+    OUTBOUND_GLOBAL_RATE = float(os.getenv("OutboundGlobalRate", "30"))
+    OUTBOUND_CONVERSATION_RATE = float(os.getenv("OutboundConversationRate", "5"))
@@ -1,17 +1,92 @@
 from __future__ import print_function
 import pickle
 import os.path
+import json
+import time
+import asyncio
+import datetime
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import httplib2
 from googleapiclient.discovery import build
 from google_auth_oauthlib.flow import InstalledAppFlow
+from google_auth_httplib2 import AuthorizedHttp
 from google.auth.transport.requests import Request
 from config import DefaultConfig
 
+# The Drive scope is only used to read the version of the spreadsheet for the sheet cache.
+# Tokens created before it was added fall back to downloading the ranges every time.
+SCOPES = ['https://www.googleapis.com/auth/spreadsheets', 'https://www.googleapis.com/auth/drive.metadata.readonly']
+
+# Blocking Sheets requests run on these threads instead of on the event loop of the bots.
+_config = DefaultConfig()
+_executor = ThreadPoolExecutor(max_workers=_config.GOOGLE_SHEETS_WORKERS)
+
+
+class SheetCache:
+    """
+        Read-through cache of sheet ranges on disk, keyed by spreadsheet id and range.
+        All ranges of a spreadsheet are dropped as soon as its Drive version changes.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._spreadsheets = {} # spreadsheet id -> {'version': version, 'ranges': {range: values}}
+        if os.path.exists(path):
+            try:
+                with open(path) as cache_file:
+                    self._spreadsheets = json.load(cache_file)
+            except ValueError:
+                pass # A corrupt cache is just an empty one.
+
+    def get(self, spreadsheet_id, version, sheet_range):
+        with self._lock:
+            spreadsheet = self._spreadsheets.get(spreadsheet_id)
+            if spreadsheet is None or spreadsheet['version'] != version:
+                return None
+            return spreadsheet['ranges'].get(sheet_range)
+
+    def put(self, spreadsheet_id, version, values_by_range):
+        with self._lock:
+            spreadsheet = self._spreadsheets.get(spreadsheet_id)
+            if spreadsheet is None or spreadsheet['version'] != version:
+                spreadsheet = self._spreadsheets[spreadsheet_id] = {'version': version, 'ranges': {}}
+            spreadsheet['ranges'].update(values_by_range)
+            self._save()
+
+    def flush(self):
+        with self._lock:
+            self._spreadsheets = {}
+            self._save()
+
+    def _save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path, 'w') as cache_file:
+            json.dump(self._spreadsheets, cache_file)
+
 
 class GoogleSheet:
+    """
+        Long lived Sheets client. The credentials and the service (with its discovery document) are loaded once,
+        the credentials are refreshed before they expire and all requests run in a bounded worker pool.
+        Use get_sheet() to obtain the shared instance.
+    """
     def __init__(self):
-        self.config = DefaultConfig()
-        SCOPES = ['https://www.googleapis.com/auth/spreadsheets']
+        start_time = time.monotonic()
+        self.config = _config
+        self.creds = self._load_credentials()
+        # The http object of the service is not thread safe, so every worker thread gets its own (see _http).
+        self.service = build('sheets', 'v4', credentials=self.creds)
+        self.drive_service = build('drive', 'v3', credentials=self.creds)
+        self.cache = SheetCache(self.config.GOOGLE_SHEETS_CACHE)
+        self._local = threading.local()
+        self._refresh_lock = threading.Lock()
+        self.startup_time = time.monotonic() - start_time
+        self.timings = {} # name -> (calls, total seconds, last seconds)
+        print(f"Google Sheets client started in {self.startup_time:.2f} seconds")
 
+    def _load_credentials(self):
         creds = None
         # The file token.pickle stores the user's access and refresh tokens, and is
         # created automatically when the authorization flow completes for the first
@@ -27,39 +102,145 @@ class GoogleSheet:
                 flow = InstalledAppFlow.from_client_secrets_file(
                     'credentials.json', SCOPES)
                 creds = flow.run_local_server(port=0)
-            # Save the credentials for the next run
-            with open('token.pickle', 'wb') as token:
-                pickle.dump(creds, token)
+            self._save_credentials(creds)
+        return creds
 
-        self.service = build('sheets', 'v4', credentials=creds)
+    def _save_credentials(self, creds):
+        # Save the credentials for the next run
+        with open('token.pickle', 'wb') as token:
+            pickle.dump(creds, token)
 
-    def get_members(self):
-        sheet = self.service.spreadsheets()
-        result = sheet.values().get(spreadsheetId=self.config.ALFAS_INFOSHEET_ID,
-                                    range=self.config.ALFAS_MEMBERS_RANGE).execute()
-        values = result.get('values', [])
-        return values
-    
-    def get_timeslots(self):
-        sheet = self.service.spreadsheets()
-        result = sheet.values().get(spreadsheetId=self.config.ALFAS_INFOSHEET_ID,
-                                    range=self.config.ALFAS_TIMESLOTS_RANGE).execute()
-        values = result.get('values', [])
-        return values
+    def _refresh_credentials(self):
+        """Refreshes the access token when it expires within GOOGLE_TOKEN_REFRESH_MARGIN seconds."""
+        margin = datetime.timedelta(seconds=self.config.GOOGLE_TOKEN_REFRESH_MARGIN)
+        with self._refresh_lock:
+            if self.creds.expiry and self.creds.expiry - datetime.datetime.utcnow() < margin:
+                self.creds.refresh(Request())
+                self._save_credentials(self.creds)
+
+    def _http(self):
+        if not hasattr(self._local, 'http'):
+            self._local.http = AuthorizedHttp(self.creds, http=httplib2.Http())
+        return self._local.http
+
+    def _execute(self, request):
+        self._refresh_credentials()
+        return request.execute(http=self._http())
+
+    async def _run(self, name, func, *args):
+        """Runs a blocking request in the worker pool and keeps track of its duration."""
+        start_time = time.monotonic()
+        loop = asyncio.get_event_loop()
+        result = await loop.run_in_executor(_executor, functools.partial(func, *args))
+
+        duration = time.monotonic() - start_time
+        calls, total, _ = self.timings.get(name, (0, 0.0, 0.0))
+        self.timings[name] = (calls + 1, total + duration, duration)
+        return result
+
+    def _get_version(self):
+        """The Drive version of the spreadsheet, one cheap metadata request. None when it cannot be read."""
+        try:
+            result = self._execute(self.drive_service.files().get(fileId=self.config.ALFAS_INFOSHEET_ID,
+                                                                  fields='version,modifiedTime'))
+        except Exception as error:
+            print(f"Could not read the version of the spreadsheet, the sheet cache is skipped: {error}")
+            return None
+        return f"{result.get('version')}@{result.get('modifiedTime')}"
+
+    def _get_values(self, sheet_range):
+        return self._batch_get_values([sheet_range])[sheet_range]
+
+    def _batch_get_values(self, sheet_ranges):
+        spreadsheet_id = self.config.ALFAS_INFOSHEET_ID
+        version = self._get_version()
+        values_by_range = {}
+        if version is not None:
+            for sheet_range in sheet_ranges:
+                values = self.cache.get(spreadsheet_id, version, sheet_range)
+                if values is not None:
+                    values_by_range[sheet_range] = values
 
-    def get_questions(self):
+        # Only the ranges that are not cached for this version are downloaded.
+        missing_ranges = [sheet_range for sheet_range in sheet_ranges if sheet_range not in values_by_range]
+        if missing_ranges:
+            sheet = self.service.spreadsheets()
+            result = self._execute(sheet.values().batchGet(spreadsheetId=spreadsheet_id, ranges=missing_ranges))
+            # The value ranges are returned in the order in which they were requested.
+            downloaded = {sheet_range: value_range.get('values', [])
+                          for sheet_range, value_range in zip(missing_ranges, result.get('valueRanges', []))}
+            if version is not None:
+                self.cache.put(spreadsheet_id, version, downloaded)
+            values_by_range.update(downloaded)
+        return values_by_range
+
+    def _save_enrollments(self, enrollments):
+        body = {
+            'values': enrollments
+        }
         sheet = self.service.spreadsheets()
-        result = sheet.values().get(spreadsheetId=self.config.ALFAS_INFOSHEET_ID,
-                                    range=self.config.CRAZY88_QUESTION_RANGE).execute()
-        values = result.get('values', [])
-        return values
-    
-    def save_enrollments(self, enrollments):
+        # Clear first, the old contents can be longer than the new.
+        self._execute(sheet.values().clear(spreadsheetId=self.config.ALFAS_INFOSHEET_ID,
+                                           range=self.config.ALFAS_ENROLLMENTS_RANGE, body={}))
+        result = self._execute(sheet.values().update(spreadsheetId=self.config.ALFAS_INFOSHEET_ID,
+                                                     range=self.config.ALFAS_ENROLLMENTS_RANGE,
+                                                     valueInputOption='RAW', body=body))
+        #print('{0} cells updated.'.format(result.get('updatedCells')))
+
+    def _append_enrollments(self, enrollments):
         body = {
             'values': enrollments
         }
         sheet = self.service.spreadsheets()
-        result = sheet.values().update(spreadsheetId=self.config.ALFAS_INFOSHEET_ID,
-                                       range=self.config.ALFAS_ENROLLMENTS_RANGE,
-                                       valueInputOption='RAW', body=body).execute()
-        #print('{0} cells updated.'.format(result.get('updatedCells')))
\ No newline at end of file
+        self._execute(sheet.values().append(spreadsheetId=self.config.ALFAS_INFOSHEET_ID,
+                                            range=self.config.ALFAS_ENROLLMENTS_RANGE,
+                                            valueInputOption='RAW', insertDataOption='INSERT_ROWS', body=body))
+
+    async def get_members(self):
+        return await self._run('get_members', self._get_values, self.config.ALFAS_MEMBERS_RANGE)
+
+    async def get_timeslots(self):
+        return await self._run('get_timeslots', self._get_values, self.config.ALFAS_TIMESLOTS_RANGE)
+
+    async def get_questions(self):
+        return await self._run('get_questions', self._get_values, self.config.CRAZY88_QUESTION_RANGE)
+
+    async def get_ranges(self, sheet_ranges):
+        """Fetches several ranges (e.g. ALFAS_MEMBERS_RANGE and ALFAS_TIMESLOTS_RANGE) in one batchGet request."""
+        return await self._run('get_ranges', self._batch_get_values, list(sheet_ranges))
+
+    async def save_enrollments(self, enrollments):
+        return await self._run('save_enrollments', self._save_enrollments, enrollments)
+
+    async def append_enrollments(self, enrollments):
+        """Appends rows below the existing enrollments instead of rewriting the whole range."""
+        return await self._run('append_enrollments', self._append_enrollments, enrollments)
+
+    async def flush_cache(self):
+        return await self._run('flush_cache', self.cache.flush)
+
+
+def is_quota_error(error):
+    """True when a Google API request failed because of rate limiting or an exceeded quota."""
+    response = getattr(error, 'resp', None)
+    status = getattr(response, 'status', None)
+    if status == 429:
+        return True
+    content = getattr(error, 'content', b'') or b''
+    return status == 403 and (b'rateLimitExceeded' in content or b'quotaExceeded' in content)
+
+
+_sheet = None
+_sheet_lock = None
+
+async def get_sheet():
+    """Returns the shared GoogleSheet client. It is created in the worker pool on first use."""
+    global _sheet, _sheet_lock
+    if _sheet is None:
+        if _sheet_lock is None:
+            _sheet_lock = asyncio.Lock()
+        async with _sheet_lock:
+            if _sheet is None:
+                loop = asyncio.get_event_loop()
+                _sheet = await loop.run_in_executor(_executor, GoogleSheet)
+    return _sheet
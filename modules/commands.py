@@ -0,0 +1,88 @@
+import time
+import modules.helper_funtions as helper
+from modules.role_index import role_index
+
+NOT_RUNNING = "Dit commando is niet actief omdat de bijbehorende bot niet draait."
+
+# All routers by name, so the admin bot can show the statistics of every bot.
+routers = {}
+
+
+class Command:
+    """
+        One command of a bot, recognised by the first word of the message.
+        handler: name of the bot method that handles the command, it is called with the turn context.
+        min_args, max_args: number of words after the name (max_args None for any number). Otherwise the usage
+                            is sent, or the command is unknown when it has no usage.
+        role: role that is checked with bot.check_role(turn_context, role) before the handler runs,
+              for the ALFAS and UITHOF bots a user type or a tuple of user types (see check_user_type).
+        requires: attribute of the bot that must be set, e.g. 'alfas_bot' for commands of a bot that may not run.
+    """
+    def __init__(self, name, handler, min_args=0, max_args=0, usage=None, role=None, requires=None):
+        self.name = name
+        self.handler = handler
+        self.min_args = min_args
+        self.max_args = max_args
+        self.usage = usage
+        self.role = role
+        self.requires = requires
+
+
+async def check_user_type(turn_context, role, refusals):
+    """
+        check_role of the bots whose roles are user types: the sender needs the user type, or one of them for a tuple.
+        Otherwise refusals[role] is sent.
+    """
+    user = await helper.get_member(turn_context)
+    user_types = role if isinstance(role, tuple) else (role,)
+    if not role_index.has_role(helper.get_user_id(user), *user_types):
+        await turn_context.send_activity(refusals[role])
+        return False
+    return True
+
+
+class CommandRouter:
+    """
+        Dispatches messages to the commands of a bot with one dict lookup on the first word,
+        and keeps the number of calls and the latency of every command.
+    """
+    def __init__(self, name, commands, unknown_message):
+        self.name = name
+        self.unknown_message = unknown_message
+        self._commands = {command.name: command for command in commands}
+        self.stats = {} # command name -> [calls, total seconds, max seconds]
+        routers[name] = self
+
+    async def dispatch(self, bot, turn_context):
+        words = turn_context.activity.text.split()
+        command = self._commands.get(words[0]) if words else None
+        if command is None:
+            await turn_context.send_activity(self.unknown_message)
+            return
+
+        args = len(words) - 1
+        if args < command.min_args or (command.max_args is not None and args > command.max_args):
+            await turn_context.send_activity(command.usage or self.unknown_message)
+            return
+
+        if command.requires and not getattr(bot, command.requires):
+            await turn_context.send_activity(NOT_RUNNING)
+            return
+
+        # check_role tells the user why the command is refused.
+        if command.role and not await bot.check_role(turn_context, command.role):
+            return
+
+        start_time = time.monotonic()
+        try:
+            await getattr(bot, command.handler)(turn_context)
+        finally:
+            duration = time.monotonic() - start_time
+            stats = self.stats.setdefault(command.name, [0, 0.0, 0.0])
+            stats[0] += 1
+            stats[1] += duration
+            stats[2] = max(stats[2], duration)
+
+    def usage(self, name):
+        """Usage of a command, for handlers that find an argument of the right count but the wrong form."""
+        return self._commands[name].usage
@@ -0,0 +1,120 @@
+import sys
+import asyncio
+from botbuilder.core import CardFactory, MessageFactory
+from botbuilder.schema import CardAction, HeroCard
+from botbuilder.schema._connector_client_enums import ActionTypes
+import modules.database as db
+import modules.helper_funtions as helper
+from modules import outbound
+
+
+class CommitteeCardRenderer:
+    """
+        Renders the 'Beschikbare Commissies' card. The attachment is cached under db.committee_version,
+        so refreshes only query the database after the availability of the committees has changed.
+    """
+    def __init__(self):
+        self.version = None
+        self._attachment = None
+        self.hits = 0
+        self.misses = 0
+
+    async def render(self):
+        version = db.committee_version
+        if self._attachment is not None and self.version == version:
+            self.hits += 1
+            return self._attachment
+
+        self.misses += 1
+        session = db.Session()
+        committees = await db.getAll(session, db.Committee, 'occupied', False)
+        session.close()
+
+        attachment = CardFactory.hero_card(
+            HeroCard(
+                title="Beschikbare Commissies",
+                text="Kies de commissie die je wil ontmoeten! Je kunt een commissie kiezen of de bot dit werk laten doen. \
+                      Klik op 'Refresh' om de lijst te vernieuwen.",
+                buttons=[
+                    CardAction(
+                        type=ActionTypes.message_back,
+                        title="\u27F3 Refresh",
+                        text=f"UpdateCard"
+                    ),
+                    CardAction(
+                        type=ActionTypes.message_back,
+                        title="\u2753 Random",
+                        text=f"RandomCommittee"
+                    )] +
+                    [CardAction(
+                        type=ActionTypes.message_back,
+                        title=committee.name,
+                        text=f"ChooseCommittee {committee.name}"
+                    ) for committee in committees]
+                )
+            )
+        # Cached under the version read before the query: a change during the query bumps the version again.
+        self.version, self._attachment = version, attachment
+        return attachment
+
+
+class OpenCommitteeCards:
+    """
+        The committee cards that are open in the mentor group channels, at most max_per_channel per channel.
+        After a claim or release refresh() updates all of them at once, debounced by `debounce` seconds so a
+        burst of matches leads to one update per card. Cards that already show the current version are skipped.
+    """
+    def __init__(self, renderer: CommitteeCardRenderer, debounce: float, max_per_channel: int):
+        self.renderer = renderer
+        self.debounce = debounce
+        self.max_per_channel = max_per_channel
+        self._cards = {} # channel id -> {activity id: [adapter, service url, conversation id, version]}
+        self._refresh_task = None
+        self._dirty = False
+        self.updates = 0
+        self.failures = 0
+
+    def track(self, channel_id, adapter, service_url, conversation_id, activity_id):
+        """Remembers a card that was sent to or updated in a mentor group channel."""
+        cards = self._cards.setdefault(channel_id, {})
+        cards.pop(activity_id, None)
+        cards[activity_id] = [adapter, service_url, conversation_id, self.renderer.version]
+        # The oldest cards of the channel are no longer updated.
+        while len(cards) > self.max_per_channel:
+            del cards[next(iter(cards))]
+
+    def refresh(self):
+        """Updates all open cards soon. Calls within the debounce window share one update."""
+        self._dirty = True
+        if self._refresh_task is None or self._refresh_task.done():
+            self._refresh_task = asyncio.ensure_future(self._refresh())
+
+    async def _refresh(self):
+        # A change during an update is followed by another round.
+        while self._dirty:
+            await asyncio.sleep(self.debounce)
+            self._dirty = False
+            attachment = await self.renderer.render()
+            version = self.renderer.version
+
+            updates = [(channel_id, activity_id, card) for channel_id, cards in self._cards.items()
+                       for activity_id, card in cards.items() if card[3] != version]
+            await asyncio.gather(*[self._update(channel_id, activity_id, card, attachment, version)
+                                   for channel_id, activity_id, card in updates])
+
+    async def _update(self, channel_id, activity_id, card, attachment, version):
+        adapter, service_url, conversation_id, _ = card
+        activity = MessageFactory.attachment(attachment)
+        activity.id = activity_id
+        try:
+            connector_client = await helper.connector_pool.get(adapter, service_url)
+            await helper.outbound_queue.send(channel_id,
+                                             lambda: connector_client.conversations.update_activity(conversation_id, activity_id, activity),
+                                             outbound.LOW)
+            card[3] = version
+            self.updates += 1
+        except Exception as error:
+            # E.g. the card was deleted, it is not updated again.
+            self.failures += 1
+            self._cards.get(channel_id, {}).pop(activity_id, None)
+            print(f"Could not update the committee card in channel {channel_id}: {error}", file=sys.stderr)
@@ -0,0 +1,89 @@
+import sys
+import asyncio
+import modules.database as db
+from modules.role_index import role_index
+
+SCHEDULER_LEASE = 'scheduler'
+
+
+class Coordinator:
+    """
+        Keeps the runtime state of this worker process in line with the other workers through the database.
+        Every `interval` seconds it:
+            - applies the lock state of the bots (Activeer/Deactiveer in any worker),
+            - reloads the role index when users changed and refreshes the committee cards when committees changed,
+            - takes or renews the scheduler lease. Only the worker that holds it runs the reminder jobs,
+              the schedulers of the other workers are paused and only add jobs to the shared job store.
+    """
+    def __init__(self, bots, scheduler, interval: float, lease: float, on_committees_changed=()):
+        self.bots = bots # name -> bot
+        self.scheduler = scheduler
+        self.interval = interval
+        self.lease = lease
+        self.on_committees_changed = list(on_committees_changed)
+        self.worker_id = db.workerId()
+        self.leader = False
+        self._counters = None
+        self._task = None
+
+    async def start(self):
+        # The first sync runs before requests are handled, so the worker starts with the shared state.
+        await self.sync()
+        self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+        if self.leader:
+            session = db.Session()
+            await db.releaseLease(session, SCHEDULER_LEASE, self.worker_id)
+            session.close()
+            self.leader = False
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.sync()
+            except Exception as error:
+                print(f"Could not sync the shared state: {error}", file=sys.stderr)
+                # The lease was not renewed, so another worker may take it over: stop running the jobs
+                # until a sync takes the lease again.
+                if self.leader:
+                    self.scheduler.pause()
+                    self.leader = False
+
+    async def sync(self):
+        session = db.Session()
+        try:
+            for name, unlocked in (await db.getBotStates(session)).items():
+                if name in self.bots:
+                    self.bots[name].unlocked = unlocked
+
+            counters = await db.getCounters(session)
+            if self._counters is not None:
+                if counters.get(db.USERS) != self._counters.get(db.USERS):
+                    await db.run(role_index.load)
+                if counters.get(db.COMMITTEES) != self._counters.get(db.COMMITTEES):
+                    db.bumpCommitteeVersion()
+                    for callback in self.on_committees_changed:
+                        callback()
+            self._counters = counters
+
+            if self.scheduler:
+                await self._elect(session)
+        finally:
+            session.close()
+
+    async def _elect(self, session):
+        leader = await db.acquireLease(session, SCHEDULER_LEASE, self.worker_id, self.lease)
+        if leader and not self.leader:
+            print(f"Worker {self.worker_id} runs the scheduler")
+            self.scheduler.resume()
+        elif not leader and self.leader:
+            self.scheduler.pause()
+        self.leader = leader
+
+        # Jobs added by other workers do not wake up the scheduler of the leader by themselves.
+        if leader:
+            self.scheduler.wakeup()
@@ -1,5 +1,10 @@
 import sqlalchemy as sa
 import os
+import socket
+import datetime
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
 from sqlalchemy import event
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, relationship, with_polymorphic
@@ -9,52 +14,163 @@ if not os.path.exists('data'):
     os.makedirs('data/')
 
 database = "sqlite:///data/database.sqlite"
+jobs_database = "sqlite:///data/jobs.sqlite"
 
-SQLAlchemyBase = declarative_base()
-engine = sa.create_engine(database, echo=False)
-Session = sessionmaker(bind=engine)
 _config = DefaultConfig()
+SQLAlchemyBase = declarative_base()
+# Queries run on the executor threads, so the connection may not be bound to the thread that opened it.
+# Every open session holds a connection across its awaits, while the checkout runs on an executor thread.
+# A checkout that waits for a free connection would block that thread, and with enough turns in flight
+# all of them, so the overflow is unlimited: DATABASE_POOL_SIZE connections are kept, the rest is closed.
+engine = sa.create_engine(database, echo=False, connect_args={'check_same_thread': False},
+                          poolclass=sa.pool.QueuePool, pool_size=_config.DATABASE_POOL_SIZE,
+                          max_overflow=-1)
+
+@event.listens_for(engine, 'connect')
+def setSQLitePragmas(dbapi_connection, connection_record):
+    """
+        Applies the engine profile to every new connection. With WAL readers do not block the writer,
+        and synchronous=NORMAL only syncs at checkpoints instead of on every commit.
+    """
+    cursor = dbapi_connection.cursor()
+    cursor.execute(f'PRAGMA journal_mode={_config.DATABASE_JOURNAL_MODE}')
+    cursor.execute(f'PRAGMA synchronous={_config.DATABASE_SYNCHRONOUS}')
+    cursor.execute(f'PRAGMA busy_timeout={_config.DATABASE_BUSY_TIMEOUT}')
+    cursor.execute(f'PRAGMA mmap_size={_config.DATABASE_MMAP_SIZE}')
+    cursor.close()
+
+# The reminder jobs of the scheduler have their own database file. Saving a job then never waits for
+# the write lock of the bot database, e.g. while a transaction of the same command holds it.
+jobs_engine = sa.create_engine(jobs_database, echo=False, connect_args={'check_same_thread': False})
+event.listen(jobs_engine, 'connect', setSQLitePragmas)
+
+# Objects keep their loaded state after a commit, so reading them afterwards on the event loop does not hit the database.
+Session = sessionmaker(bind=engine, expire_on_commit=False)
+
+# All blocking database work is done on these threads instead of on the event loop of the bots.
+_executor = ThreadPoolExecutor(max_workers=_config.DATABASE_WORKERS)
+
+async def run(func, *args, **kwargs):
+    """Runs a blocking database function on the database executor and waits for the result."""
+    loop = asyncio.get_event_loop()
+    return await loop.run_in_executor(_executor, functools.partial(func, *args, **kwargs))
+
+def awaitable(func):
+    """Makes a blocking database helper awaitable. The blocking version stays available as `func.__wrapped__`."""
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        return await run(func, *args, **kwargs)
+    return wrapper
+
+def transactional(func):
+    """
+        Makes a blocking helper with several reads and writes awaitable as one transaction:
+
+            @transactional
+            def releaseMentorGroup(session, mentor_group):
+                ...
+
+        The whole helper runs in one call on the database executor, and inside it the write helpers only flush.
+        It commits when the helper returns and rolls everything back when it raises. The transaction holds the
+        write lock from its first write until the commit and keeps its executor thread all that time: otherwise
+        the other writers, waiting for that lock, could take every executor thread and leave none to commit on.
+        The blocking version stays available as `func.__wrapped__`, so transactional helpers can call each other.
+    """
+    @functools.wraps(func)
+    def in_transaction(session, *args, **kwargs):
+        depth = session.info.get('unit_of_work', 0)
+        session.info['unit_of_work'] = depth + 1
+        try:
+            result = func(session, *args, **kwargs)
+        except BaseException:
+            if not depth:
+                session.rollback()
+            raise
+        finally:
+            session.info['unit_of_work'] = depth
+        if not depth:
+            session.commit()
+        return result
+    return awaitable(in_transaction)
+
+def _commit(session):
+    """Commits, unless the session is inside a transactional helper. Then the writes are only flushed."""
+    if session.info.get('unit_of_work'):
+        session.flush()
+    else:
+        session.commit()
 
 #TODO: build database management functions to be called from elsewhere
-# To be able to use these functions, you need to create a new session.
+# To be able to use these functions, you need to create a new session and await the function.
 # When done, close the session!
 
+@awaitable
 def getFirst(session, table, column, value):
     return_value = session.query(table).filter_by(**{column: value}).first()
     return return_value
 
+@awaitable
 def getAll(session, table, column, value):
     return_value = session.query(table).filter_by(**{column: value}).all()
     return return_value
 
+@awaitable
 def getTable(session, table):
     return_value = session.query(table).all()
     return return_value
 
+@awaitable
 def dbInsert(session, db_object):
     """Inserts object"""
     if(db_object):
         session.add(db_object)
-        session.commit()
+        _commit(session)
 
+@awaitable
+def dbInsertAll(session, db_objects):
+    """Inserts all objects in one transaction"""
+    if(db_objects):
+        session.add_all(db_objects)
+        _commit(session)
+
+@awaitable
+def dbCommit(session):
+    """Commits all pending changes of the session"""
+    _commit(session)
+
+@awaitable
 def dbMerge(session, db_object):
     """Updates object"""
     if(db_object):
         session.merge(db_object)
-        session.commit()
+        _commit(session)
 
+@awaitable
+def dbDelete(session, db_object):
+    """Deletes object"""
+    if(db_object):
+        session.delete(db_object)
+        _commit(session)
+
+@awaitable
 def getUserOnType(session, user_type, teams_id):
-    return_value = session.query(User).filter((User.user_teams_id == teams_id) & (User.user_type == user_type)).first()
+    # Load the columns of the subclass tables as well, so reading e.g. mg_id later does not query again.
+    users = with_polymorphic(User, '*')
+    return_value = session.query(users).filter((users.user_teams_id == teams_id) & (users.user_type == user_type)).first()
 
     return return_value
 
+@awaitable
 def getAllUsersOnType(session, user_type):
-    return_value = session.query(User).filter(User.user_type == user_type).all()
+    users = with_polymorphic(User, '*')
+    return_value = session.query(users).filter(users.user_type == user_type).all()
     return return_value
 
+@awaitable
 def getEnrollment(session, committee_id, email):
     return session.query(Enrollment).filter((Enrollment.committee_id == committee_id) & (Enrollment.email_address == email)).first()
 
+@awaitable
 def getAssociationPlanning(session, mg_id):
     mentor_group = session.query(MentorGroup).filter(MentorGroup.mg_id == mg_id).first()
     association_times = []
@@ -62,33 +178,245 @@ def getAssociationPlanning(session, mg_id):
         association_times.append((association, eval(f'mentor_group.{association}_timeslot')))
     return association_times
 
+@awaitable
 def getActiveVisit(session, committee_id):
     visit = session.query(Visit).filter((Visit.committee_id == committee_id) & (Visit.finished == False)).first()
     return visit
 
+@awaitable
 def getActiveVisitMG(session, mentor_group_id):
     visit = session.query(Visit).filter((Visit.mg_id == mentor_group_id) & (Visit.finished == False)).first()
     return visit
 
+@awaitable
 def getNonVisitedCommittees(session, mg_id):
-    visits = session.query(Visit).filter((Visit.mg_id == mg_id) & (Visit.finished == True))
-    committees = getAll(session, Committee, 'occupied', False)
-    return_value = []
+    """Free committees that the mentor group has not visited yet, as a single NOT EXISTS query."""
+    visited = session.query(Visit).filter((Visit.mg_id == mg_id) &
+                                          (Visit.committee_id == Committee.committee_id) &
+                                          (Visit.finished == True))
+    return_value = session.query(Committee).filter((Committee.occupied == False) & ~visited.exists()).all()
+    return return_value
+
+@awaitable
+def getEnrollmentRows(session, only_new):
+    """
+        Enrollments together with the name of their committee, in a single join query.
+        With only_new, only the enrollments that are not exported yet are returned.
+    """
+    query = session.query(Enrollment, Committee.name).join(Committee, Enrollment.committee_id == Committee.committee_id)
+    if only_new:
+        query = query.filter(Enrollment.exported == False)
+    return_value = query.order_by(Committee.name, Enrollment.enroll_id).all()
+    return return_value
 
-    for committee in committees:
-        if next(filter(lambda visit: visit.committee_id == committee.committee_id, visits), None):
+# Older SQLite versions allow at most 999 parameters in one statement.
+_MAX_PARAMETERS = 900
+
+@awaitable
+def markEnrollmentsExported(session, enroll_ids):
+    """Marks the given enrollments as exported with a bulk update per _MAX_PARAMETERS ids, in one transaction"""
+    if enroll_ids:
+        for start in range(0, len(enroll_ids), _MAX_PARAMETERS):
+            session.query(Enrollment).filter(Enrollment.enroll_id.in_(enroll_ids[start:start + _MAX_PARAMETERS])) \
+                   .update({Enrollment.exported: True}, synchronize_session=False)
+        _commit(session)
+
+# Results of claimCommittee
+CLAIMED = 'claimed'
+COMMITTEE_OCCUPIED = 'committee_occupied'
+GROUP_OCCUPIED = 'group_occupied'
+
+@awaitable
+def claimCommittee(session, committee_id, mg_id):
+    """
+        Atomically matches a free committee with a free mentor group and creates their visit.
+        Both are claimed with a compare-and-set UPDATE (occupied 0 -> 1) in one transaction, so when
+        several groups click at the same time only one of them gets the committee.
+        Always commits or rolls back by itself, so do not call it inside a transactional helper.
+    """
+    # When many groups click at once, most claims are for a group or committee that was just taken. Those are
+    # answered with a read, which does not wait for the write lock. The updates below still decide.
+    # Nothing is written then, so it ends with a commit: a rollback would expire the objects of the caller,
+    # which would reload them on the event loop.
+    if session.query(MentorGroup.occupied).filter(MentorGroup.mg_id == mg_id).scalar():
+        session.commit()
+        return GROUP_OCCUPIED
+    if session.query(Committee.occupied).filter(Committee.committee_id == committee_id).scalar():
+        session.commit()
+        return COMMITTEE_OCCUPIED
+
+    claimed_groups = session.query(MentorGroup).filter((MentorGroup.mg_id == mg_id) & (MentorGroup.occupied == False)) \
+                            .update({MentorGroup.occupied: True}, synchronize_session='evaluate')
+    if not claimed_groups:
+        session.rollback()
+        return GROUP_OCCUPIED
+
+    claimed_committees = session.query(Committee).filter((Committee.committee_id == committee_id) & (Committee.occupied == False)) \
+                                .update({Committee.occupied: True}, synchronize_session='evaluate')
+    if not claimed_committees:
+        session.rollback()
+        return COMMITTEE_OCCUPIED
+
+    session.add(Visit(mg_id=mg_id, committee_id=committee_id))
+    session.commit()
+    return CLAIMED
+
+@awaitable
+def releaseAll(session):
+    """Finishes all visits and frees all mentor groups and committees with three bulk updates"""
+    session.query(Visit).filter(Visit.finished == False).update({Visit.finished: True}, synchronize_session=False)
+    session.query(MentorGroup).update({MentorGroup.occupied: False}, synchronize_session=False)
+    session.query(Committee).update({Committee.occupied: False}, synchronize_session=False)
+    _commit(session)
+
+@awaitable
+def shiftTimeslots(session, association, minutes):
+    """
+        Shifts the timeslots of an association for all mentor groups with one UPDATE.
+        Timeslots have no date, so a shift that would move one past midnight is refused: returns None then,
+        otherwise the number of shifted timeslots.
+    """
+    column = getattr(MentorGroup, f'{association}_timeslot')
+    first, last, count = session.query(sa.func.min(column), sa.func.max(column), sa.func.count(column)).one()
+    if not count:
+        return 0
+
+    day = _config.ALFAS_DATE
+    delay = datetime.timedelta(minutes=minutes)
+    if (datetime.datetime.combine(day, first) + delay).date() != day or \
+       (datetime.datetime.combine(day, last) + delay).date() != day:
+        return None
+
+    # Same format in which SQLAlchemy stores times in SQLite.
+    session.query(MentorGroup).filter(column != None) \
+           .update({column: sa.func.strftime('%H:%M:%S.000000', column, f'{minutes:+d} minutes')},
+                   synchronize_session=False)
+    _commit(session)
+    return count
+
+@transactional
+def releaseCommittee(session, committee):
+    """Frees a committee together with its mentor group and finishes their visit. Returns the mentor group."""
+    committee.occupied = False
+    session.merge(committee)
+    visit = getActiveVisit.__wrapped__(session, committee.committee_id)
+    visit.finished = True
+    mentor_group = getFirst.__wrapped__(session, MentorGroup, 'mg_id', visit.mg_id)
+    mentor_group.occupied = False
+    return mentor_group
+
+@transactional
+def releaseMentorGroup(session, mentor_group):
+    """Frees a mentor group and finishes its visit, if it has one."""
+    mentor_group.occupied = False
+    session.merge(mentor_group)
+    active_visit = getActiveVisitMG.__wrapped__(session, mentor_group.mg_id)
+    if active_visit:
+        active_visit.finished = True
+
+@transactional
+def setTimeslots(session, timeslots):
+    """
+        Saves the timeslots of the mentor groups, a list of (mentor group name, {association: time}).
+        Returns the mentor groups that were found and the names of those that do not exist.
+    """
+    mentor_groups = []
+    not_existing = []
+    for name, times in timeslots:
+        mentor_group = getFirst.__wrapped__(session, MentorGroup, 'name', name)
+        if not mentor_group:
+            not_existing.append(name)
             continue
-        return_value.append(committee)
+        for association, time in times.items():
+            setattr(mentor_group, f'{association}_timeslot', time)
+        mentor_groups.append(mentor_group)
+    return mentor_groups, not_existing
+
+@transactional
+def addUSPVisit(session, mentor_group, location):
+    """
+        Puts a mentor group in the queue of a USP location. When the location is free, both are occupied.
+        Returns whether the location was free.
+    """
+    free = not location.occupied
+    if free:
+        location.occupied = True
+        mentor_group.occupied = True
+        session.merge(location)
+        session.merge(mentor_group)
+    session.add(USPVisit(mg_id=mentor_group.mg_id, location_id=location.location_id))
+    return free
+
+@transactional
+def finishUSPVisit(session, visit, mentor_group):
+    """Removes the visit of a mentor group to a USP location and frees the mentor group."""
+    mentor_group.occupied = False
+    session.merge(mentor_group)
+    session.delete(visit)
+
+def workerId():
+    """Identifies this worker process, e.g. as the owner of a lease."""
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+@awaitable
+def getCounters(session):
+    return_value = dict(session.query(Counter.name, Counter.value).all())
+    session.commit() # ends the read transaction, so the next call sees new changes
+    return return_value
+
+@awaitable
+def getBotStates(session):
+    return_value = dict(session.query(BotState.name, BotState.unlocked).all())
+    session.commit()
     return return_value
 
+@awaitable
+def setBotUnlocked(session, name, unlocked):
+    session.merge(BotState(name=name, unlocked=unlocked))
+    _commit(session)
+
+@awaitable
+def acquireLease(session, name, owner, seconds):
+    """
+        Takes or renews the lease when it is free, expired or already ours, with a compare-and-set UPDATE.
+        Returns whether this owner holds the lease for the next `seconds` seconds.
+        Always commits or rolls back by itself, so do not call it inside a transactional helper.
+    """
+    now = datetime.datetime.utcnow()
+    expires_at = now + datetime.timedelta(seconds=seconds)
+    acquired = session.query(Lease).filter((Lease.name == name) & ((Lease.owner == owner) | (Lease.expires_at < now))) \
+                      .update({Lease.owner: owner, Lease.expires_at: expires_at}, synchronize_session=False)
+    if acquired:
+        session.commit()
+        return True
+
+    if session.query(Lease).filter(Lease.name == name).first():
+        session.commit()
+        return False
+    session.add(Lease(name=name, owner=owner, expires_at=expires_at))
+    try:
+        session.commit()
+    except sa.exc.IntegrityError: # another worker inserted it first
+        session.rollback()
+        return False
+    return True
+
+@awaitable
+def releaseLease(session, name, owner):
+    session.query(Lease).filter((Lease.name == name) & (Lease.owner == owner)) \
+           .update({Lease.expires_at: datetime.datetime.utcnow()}, synchronize_session=False)
+    session.commit()
+
 #TODO: build database tables
 
 class User(SQLAlchemyBase):
     __tablename__ = 'user'
     user_id = sa.Column(sa.Integer, primary_key=True)
-    user_teams_id = sa.Column(sa.String(50), index=True)
+    user_teams_id = sa.Column(sa.String(50))
     user_name = sa.Column(sa.String(50))
     user_type = sa.Column(sa.String(50))
+    # Every permission check looks a user up on both columns.
+    __table_args__ = (sa.Index('ix_user_teams_id_type', 'user_teams_id', 'user_type'),)
 
     __mapper_args__ = {
         'polymorphic_identity':'user',
@@ -167,15 +495,18 @@ class USPLocation(SQLAlchemyBase):
 class Visit(SQLAlchemyBase):
     __tablename__ = 'visit'
     visit_id = sa.Column(sa.Integer, primary_key=True)
-    mg_id = sa.Column(sa.String(50))
-    committee_id = sa.Column(sa.String(50), index=True)
+    mg_id = sa.Column(sa.Integer, sa.ForeignKey('mentor_group.mg_id'))
+    committee_id = sa.Column(sa.Integer, sa.ForeignKey('committee.committee_id'))
     finished = sa.Column(sa.Boolean, default=False)
+    # Active and finished visits are always looked up per committee or per mentor group.
+    __table_args__ = (sa.Index('ix_visit_committee_finished', 'committee_id', 'finished'),
+                      sa.Index('ix_visit_mg_finished', 'mg_id', 'finished'))
 
 class USPVisit(SQLAlchemyBase):
     __tablename__ = 'usp_queue'
     visit_id = sa.Column(sa.Integer, primary_key=True)
-    mg_id = sa.Column(sa.String(50))
-    location_id = sa.Column(sa.String(50), index=True)
+    mg_id = sa.Column(sa.Integer, sa.ForeignKey('mentor_group.mg_id'), index=True)
+    location_id = sa.Column(sa.Integer, sa.ForeignKey('usp_location.location_id'), index=True)
 
 class Enrollment(SQLAlchemyBase):
     __tablename__ = 'enrollment'
@@ -184,11 +515,135 @@ class Enrollment(SQLAlchemyBase):
     first_name = sa.Column(sa.String(50))
     last_name = sa.Column(sa.String(50))
     email_address = sa.Column(sa.String(50))
+    # Set once the enrollment is written to the enrollments sheet.
+    exported = sa.Column(sa.Boolean, nullable=False, default=False, server_default='0', index=True)
     __table_args__ = (sa.UniqueConstraint('committee_id', 'email_address', name='_id_email_uc'),)
 
+# Runtime state that is shared by all worker processes (see modules/coordinator.py).
+
+class BotState(SQLAlchemyBase):
+    __tablename__ = 'bot_state'
+    name = sa.Column(sa.String(50), primary_key=True)
+    unlocked = sa.Column(sa.Boolean, nullable=False, default=True)
+
+class Lease(SQLAlchemyBase):
+    """A lease on a task that only one worker process may do at a time, e.g. running the scheduler."""
+    __tablename__ = 'lease'
+    name = sa.Column(sa.String(50), primary_key=True)
+    owner = sa.Column(sa.String(100))
+    expires_at = sa.Column(sa.DateTime)
+
+class Counter(SQLAlchemyBase):
+    """Change counters, incremented in the same transaction as the change they count."""
+    __tablename__ = 'counter'
+    name = sa.Column(sa.String(50), primary_key=True)
+    value = sa.Column(sa.Integer, nullable=False, default=0)
+
+# Counters of the tables that the worker processes cache in memory.
+COMMITTEES = 'committees'
+USERS = 'users'
+
 @event.listens_for(User, 'mapper_configured')
 def receive_mapper_configured(mapper, class_):
     # to prevent 'incompatible polymorphic identity' warning, not mandatory
     mapper._validate_polymorphic_identity = None
 
+# Version of the committee availability, bumped after every commit that changed a committee
+# (e.g. occupied by a match or a release). Renderers of the committee card cache on it.
+committee_version = 0
+
+def bumpCommitteeVersion():
+    """Called when another worker process changed the committees."""
+    global committee_version
+    committee_version += 1
+
+def _incrementCounter(connection, name):
+    connection.execute(Counter.__table__.update().where(Counter.name == name).values(value=Counter.value + 1))
+
+@event.listens_for(Session, 'after_flush')
+def receive_after_flush(session, flush_context):
+    changed = list(session.new) + list(session.dirty) + list(session.deleted)
+    if any(isinstance(obj, Committee) for obj in changed):
+        session.info['committees_changed'] = True
+        _incrementCounter(session.connection(), COMMITTEES)
+    if any(isinstance(obj, User) for obj in changed):
+        _incrementCounter(session.connection(), USERS)
+
+@event.listens_for(Session, 'after_bulk_update')
+def receive_after_bulk_update(update_context):
+    if update_context.mapper.class_ is Committee:
+        update_context.session.info['committees_changed'] = True
+        _incrementCounter(update_context.session.connection(), COMMITTEES)
+
+# Only bumped on commit, so a card rendered in between never caches uncommitted availability under the new version.
+@event.listens_for(Session, 'after_commit')
+def receive_after_commit(session):
+    global committee_version
+    if session.info.pop('committees_changed', False):
+        committee_version += 1
+
+@event.listens_for(Session, 'after_rollback')
+def receive_after_rollback(session):
+    session.info.pop('committees_changed', None)
+
+def _rebuildTable(connection, table):
+    """
+        SQLite cannot change the type of a column, so the table is recreated with the current
+        definition and the rows are copied over with the new column types.
+    """
+    old_name = f'{table.name}_old'
+    connection.execute(sa.text(f'ALTER TABLE {table.name} RENAME TO {old_name}'))
+    # The indexes moved along with the renamed table and would collide with the new ones.
+    old_indexes = connection.execute(sa.text("SELECT name FROM sqlite_master WHERE type = 'index' "
+                                             "AND tbl_name = :table AND sql IS NOT NULL"), {'table': old_name}).fetchall()
+    for (index_name,) in old_indexes:
+        connection.execute(sa.text(f'DROP INDEX {index_name}'))
+
+    table.create(connection)
+    columns = ', '.join(column.name for column in table.columns)
+    values = ', '.join(f'CAST({column.name} AS INTEGER)' if isinstance(column.type, sa.Integer) else column.name
+                       for column in table.columns)
+    connection.execute(sa.text(f'INSERT INTO {table.name} ({columns}) SELECT {values} FROM {old_name}'))
+    connection.execute(sa.text(f'DROP TABLE {old_name}'))
+
+# Indexes of earlier versions that a composite index with the same first column replaces.
+# Left in place they only slow down the writes, and SQLite may still pick them for the lookups.
+_OBSOLETE_INDEXES = ('ix_user_user_teams_id', 'ix_visit_committee_id')
+
+def upgradeSchema(engine):
+    """
+        Brings an existing database up to date with the models in place:
+        the visit tables get integer foreign keys, every table gets its missing columns and indexes
+        and the indexes that were replaced are dropped.
+    """
+    with engine.begin() as connection:
+        for table in (Visit.__table__, USPVisit.__table__):
+            column_types = {row[1]: row[2] for row in connection.execute(sa.text(f'PRAGMA table_info({table.name})'))}
+            if column_types.get('mg_id', '').upper().startswith('VARCHAR'):
+                _rebuildTable(connection, table)
+
+        # create_all does not add columns to tables that already exist either.
+        for table in SQLAlchemyBase.metadata.sorted_tables:
+            existing_columns = {row[1] for row in connection.execute(sa.text(f'PRAGMA table_info({table.name})'))}
+            for column in table.columns:
+                if column.name not in existing_columns:
+                    column_type = column.type.compile(dialect=engine.dialect)
+                    default = f' NOT NULL DEFAULT {column.server_default.arg}' if column.server_default is not None else ''
+                    connection.execute(sa.text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}{default}'))
+
+        for index_name in _OBSOLETE_INDEXES:
+            connection.execute(sa.text(f'DROP INDEX IF EXISTS {index_name}'))
+
+        # create_all does not add indexes to tables that already exist.
+        existing_indexes = {row[0] for row in connection.execute(sa.text("SELECT name FROM sqlite_master WHERE type = 'index'"))}
+        for table in SQLAlchemyBase.metadata.sorted_tables:
+            for index in table.indexes:
+                if index.name not in existing_indexes:
+                    index.create(connection)
+
+        # The counters are only incremented, so their rows have to exist.
+        for name in (COMMITTEES, USERS):
+            connection.execute(sa.text('INSERT OR IGNORE INTO counter (name, value) VALUES (:name, 0)'), {'name': name})
+
 SQLAlchemyBase.metadata.create_all(engine)
+upgradeSchema(engine)
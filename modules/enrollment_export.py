@@ -0,0 +1,48 @@
+import asyncio
+import modules.database as db
+from google_api import get_sheet
+
+HEADER = ['Commissie', 'Voornaam', 'Achternaam', 'UU-mail']
+
+_export_lock = None
+
+EXPORT_LEASE = 'enrollment_export'
+# Long enough for a full rebuild of the sheet, a crashed worker blocks the exports at most this long.
+EXPORT_LEASE_SECONDS = 120
+
+async def export_enrollments(full=False):
+    """
+        Writes the enrollments to the enrollments sheet. Normally only the enrollments that were not exported yet
+        are appended below the existing rows. With full (or when nothing was exported before) the sheet is rebuilt.
+        Returns the number of enrollments that were written.
+    """
+    global _export_lock
+    if _export_lock is None:
+        _export_lock = asyncio.Lock()
+
+    # Two exports at the same time would append the same enrollments twice. The lock covers this worker,
+    # the lease in the database the other worker processes.
+    async with _export_lock:
+        session = db.Session()
+        owner = db.workerId()
+        while not await db.acquireLease(session, EXPORT_LEASE, owner, EXPORT_LEASE_SECONDS):
+            await asyncio.sleep(1)
+        try:
+            if not full and not await db.getFirst(session, db.Enrollment, 'exported', True):
+                full = True
+
+            rows = await db.getEnrollmentRows(session, only_new=not full)
+            google_values = [[committee_name, enrollment.first_name, enrollment.last_name, enrollment.email_address]
+                             for enrollment, committee_name in rows]
+
+            sheet = await get_sheet()
+            if full:
+                await sheet.save_enrollments([HEADER] + google_values)
+            elif google_values:
+                await sheet.append_enrollments(google_values)
+
+            await db.markEnrollmentsExported(session, [enrollment.enroll_id for enrollment, _ in rows])
+        finally:
+            await db.releaseLease(session, EXPORT_LEASE, owner)
+            session.close()
+    return len(rows)
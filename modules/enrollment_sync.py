@@ -0,0 +1,91 @@
+import sys
+import asyncio
+from google_api import is_quota_error
+from modules.enrollment_export import export_enrollments
+
+
+class EnrollmentSync:
+    """
+        Write-behind sync of new enrollments to the enrollments sheet. Enrolling only queues the enrollment,
+        a background task appends the queued enrollments in batches: as soon as batch_size are waiting or
+        interval seconds after the first one. Quota errors are retried with exponential backoff, after other
+        errors the next try waits for the interval, also when the batch is full.
+    """
+    def __init__(self, batch_size: int, interval: float, max_backoff: float):
+        self.batch_size = batch_size
+        self.interval = interval
+        self.max_backoff = max_backoff
+        self._pending = 0
+        self._stopping = False
+        self._wake = None
+        self._stop_requested = None
+        self._task = None
+
+    def start(self):
+        if self._task is None:
+            self._wake = asyncio.Event()
+            self._stop_requested = asyncio.Event()
+            self._task = asyncio.ensure_future(self._run())
+
+    def enqueue(self, count=1):
+        """Queues new enrollments. They are already in the database, the sync only has to export them."""
+        self.start()
+        self._pending += count
+        if self._pending == count or self._pending >= self.batch_size:
+            self._wake.set()
+
+    async def stop(self):
+        """Stops the background task after exporting everything that is still queued."""
+        if self._task is None:
+            return
+        self._stopping = True
+        self._wake.set()
+        self._stop_requested.set()
+        await self._task
+
+    async def _run(self):
+        while not self._stopping:
+            if not self._pending:
+                await self._wake.wait()
+                self._wake.clear()
+                continue
+
+            # Wait until the batch is full or the interval has passed.
+            if self._pending < self.batch_size:
+                try:
+                    await asyncio.wait_for(self._wake.wait(), self.interval)
+                except asyncio.TimeoutError:
+                    pass
+                self._wake.clear()
+            await self._flush()
+
+        if self._pending:
+            await self._flush()
+
+    async def _flush(self):
+        pending = self._pending
+        backoff = 1
+        while True:
+            try:
+                await export_enrollments()
+                # Enrollments queued during the export stay queued for the next batch.
+                self._pending -= pending
+                return
+            except Exception as error:
+                if self._stopping:
+                    print(f"Could not sync the enrollments to the sheet: {error}", file=sys.stderr)
+                    return
+                if not is_quota_error(error):
+                    print(f"Could not sync the enrollments to the sheet: {error}", file=sys.stderr)
+                    # E.g. no network or an expired token: a full batch would otherwise retry right away.
+                    await self._wait(self.interval)
+                    return
+                await self._wait(backoff)
+                backoff = min(backoff * 2, self.max_backoff)
+
+    async def _wait(self, seconds):
+        # Waits on its own event: new enrollments do not end the wait, stop() does.
+        try:
+            await asyncio.wait_for(self._stop_requested.wait(), seconds)
+        except asyncio.TimeoutError:
+            pass
@@ -1,16 +1,66 @@
+import sys
+import asyncio
 from botbuilder.core import CardFactory, TurnContext, MessageFactory
+from botbuilder.core.teams import TeamsInfo
 from botbuilder.schema import CardAction, HeroCard, Mention, ConversationParameters
+from config import DefaultConfig
+from modules.member_cache import MemberCache
+from modules import outbound
 
-async def create_channel_conversation(turn_context: TurnContext, teams_channel_id: str, message):
+_config = DefaultConfig()
+
+# Shared by all bots, so a sender is only looked up at the Teams connector once in a while.
+member_cache = MemberCache(_config.MEMBER_CACHE_SIZE, _config.MEMBER_CACHE_TTL)
+
+# All proactive messages of all bots go through the outbound queue, with connector clients from the pool.
+# The global rate is shared by the worker processes.
+connector_pool = outbound.ConnectorPool()
+outbound_queue = outbound.OutboundQueue(_config.OUTBOUND_WORKERS, _config.OUTBOUND_RETRIES,
+                                        _config.OUTBOUND_GLOBAL_RATE / _config.WORKERS, _config.OUTBOUND_CONVERSATION_RATE)
+
+async def get_member(turn_context: TurnContext):
+    """Returns the Teams member that sent the activity, from the member cache when possible."""
+    member_id = turn_context.activity.from_property.id
+    member = member_cache.get(member_id)
+
+    if member is None:
+        member = await TeamsInfo.get_member(turn_context, member_id)
+        member_cache.put(member_id, member)
+    return member
+
+def invalidate_members(members):
+    """Drops the given members from the member cache, e.g. when they join or leave the team."""
+    for member in members:
+        member_cache.invalidate(member.id)
+
+async def create_channel_conversation(turn_context: TurnContext, teams_channel_id: str, message, priority=outbound.NORMAL):
     params = ConversationParameters(
         is_group=True,
         channel_data={"channel": {"id": teams_channel_id}},
         activity=message
     )
-    connector_client = await turn_context.adapter.create_connector_client(turn_context.activity.service_url)
-    await connector_client.conversations.create_conversation(params)
+    connector_client = await connector_pool.get(turn_context.adapter, turn_context.activity.service_url)
+    return await outbound_queue.send(teams_channel_id,
+                                     lambda: connector_client.conversations.create_conversation(params),
+                                     priority)
+
+async def create_channel_conversations(turn_context: TurnContext, channel_messages, priority=outbound.LOW):
+    """
+        Sends every (channel id, message) pair concurrently through the outbound queue,
+        which takes care of throttling and retries. Returns (succeeded, failed).
+    """
+    async def send(channel_id, message):
+        try:
+            await create_channel_conversation(turn_context, channel_id, message, priority)
+            return True
+        except Exception as error:
+            print(f"Could not send message to channel {channel_id}: {error}", file=sys.stderr)
+            return False
+
+    results = await asyncio.gather(*[send(channel_id, message) for channel_id, message in channel_messages])
+    return results.count(True), results.count(False)
 
-async def create_personal_conversation(turn_context: TurnContext, user, message, app_id):
+async def create_personal_conversation(turn_context: TurnContext, user, message, app_id, priority=outbound.NORMAL):
     conversation_reference = TurnContext.get_conversation_reference(turn_context.activity)
     params = ConversationParameters(
         is_group=False,
@@ -32,7 +82,9 @@ async def create_personal_conversation(turn_context: TurnContext, user, message,
             message
         )  # pylint: disable=cell-var-from-loop
 
-    await turn_context.adapter.create_conversation(conversation_reference, get_ref, params)
+    await outbound_queue.send(user.id,
+                              lambda: turn_context.adapter.create_conversation(conversation_reference, get_ref, params),
+                              priority)
 
 def get_user_id(user):
     return user.aad_object_id if user.aad_object_id else user.additional_properties['aadObjectId']
@@ -0,0 +1,44 @@
+import time
+from collections import OrderedDict
+
+
+class MemberCache:
+    """
+        Size bounded cache for Teams members with a time to live per entry.
+        When the cache is full, the least recently used member is dropped.
+    """
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._members = OrderedDict() # member id -> (expiry time, member)
+
+    def get(self, member_id):
+        entry = self._members.get(member_id)
+
+        if entry is None or entry[0] < time.monotonic():
+            # Unknown or expired, the caller has to fetch the member again.
+            self._members.pop(member_id, None)
+            self.misses += 1
+            return None
+
+        self._members.move_to_end(member_id)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, member_id, member):
+        self._members[member_id] = (time.monotonic() + self.ttl, member)
+        self._members.move_to_end(member_id)
+
+        while len(self._members) > self.max_size:
+            self._members.popitem(last=False)
+
+    def invalidate(self, member_id):
+        self._members.pop(member_id, None)
+
+    def clear(self):
+        self._members.clear()
+
+    def stats(self):
+        return {'size': len(self._members), 'hits': self.hits, 'misses': self.misses}
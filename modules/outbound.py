@@ -0,0 +1,112 @@
+import time
+import asyncio
+import itertools
+
+# Priorities of outbound messages, lower is sent first.
+HIGH = 0 # direct results of a command, e.g. a match
+NORMAL = 1
+LOW = 2 # bulk messages, e.g. announcements and reminders
+
+
+def get_retry_delay(error, attempt):
+    """Seconds to wait before retrying a request that failed with this error, or None if it should not be retried."""
+    response = getattr(error, 'response', None)
+    if getattr(response, 'status_code', None) not in (429, 502, 503, 504):
+        return None
+
+    retry_after = response.headers.get('Retry-After') if response.headers else None
+    try:
+        return float(retry_after)
+    except (TypeError, ValueError):
+        return 2 ** attempt
+
+
+class RateLimiter:
+    """Token bucket that allows `rate` requests per second, with bursts of up to `burst` requests."""
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._updated = time.monotonic()
+
+    def reserve(self):
+        """Takes a token and returns how many seconds to wait before it may be used."""
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        self._tokens -= 1
+        return 0 if self._tokens >= 0 else -self._tokens / self.rate
+
+
+class ConnectorPool:
+    """Keeps one connector client per adapter and service url instead of building one for every message."""
+    def __init__(self):
+        self._clients = {}
+
+    async def get(self, adapter, service_url):
+        key = (id(adapter), service_url)
+        if key not in self._clients:
+            self._clients[key] = await adapter.create_connector_client(service_url)
+        return self._clients[key]
+
+
+class OutboundQueue:
+    """
+        Prioritised queue for all proactive messages to Teams. A fixed number of workers send the messages,
+        limited by a global rate and a rate per conversation. Throttled messages are retried after the
+        Retry-After that Teams asks for.
+    """
+    def __init__(self, workers: int, retries: int, global_rate: float, conversation_rate: float):
+        self.workers = workers
+        self.retries = retries
+        self._global_limiter = RateLimiter(global_rate, max(1, int(global_rate)))
+        self._conversation_rate = conversation_rate
+        self._conversation_limiters = {}
+        self._order = itertools.count() # keeps messages with the same priority in order
+        self._queue = None
+        self._tasks = []
+
+    async def send(self, conversation_id, send, priority=NORMAL):
+        """
+            Queues `send`, an async function without arguments that does the request, and waits for its result.
+            Exceptions of the request (after the retries) are raised here.
+        """
+        if self._queue is None:
+            self._queue = asyncio.PriorityQueue()
+            self._tasks = [asyncio.ensure_future(self._worker()) for _ in range(self.workers)]
+
+        future = asyncio.get_event_loop().create_future()
+        await self._queue.put((priority, next(self._order), conversation_id, send, future))
+        return await future
+
+    def _conversation_limiter(self, conversation_id):
+        if conversation_id not in self._conversation_limiters:
+            self._conversation_limiters[conversation_id] = RateLimiter(self._conversation_rate,
+                                                                       max(1, int(self._conversation_rate)))
+        return self._conversation_limiters[conversation_id]
+
+    async def _worker(self):
+        while True:
+            _, _, conversation_id, send, future = await self._queue.get()
+            try:
+                delay = max(self._global_limiter.reserve(), self._conversation_limiter(conversation_id).reserve())
+                if delay:
+                    await asyncio.sleep(delay)
+                result = await self._send_with_retries(send)
+                if not future.done():
+                    future.set_result(result)
+            except Exception as error:
+                if not future.done():
+                    future.set_exception(error)
+            finally:
+                self._queue.task_done()
+
+    async def _send_with_retries(self, send):
+        for attempt in range(self.retries + 1):
+            try:
+                return await send()
+            except Exception as error:
+                delay = get_retry_delay(error, attempt)
+                if delay is None or attempt == self.retries:
+                    raise
+                await asyncio.sleep(delay)
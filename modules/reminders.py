@@ -0,0 +1,155 @@
+import time
+import asyncio
+import datetime
+from collections import deque
+from botbuilder.core import MessageFactory
+from botbuilder.schema import ConversationReference
+import modules.database as db
+import modules.helper_funtions as helper
+from modules import outbound
+from config import DefaultConfig
+
+_config = DefaultConfig()
+
+# Adapters by app id. They are registered at startup, so jobs from the job store can reach Teams after a restart.
+_adapters = {}
+
+# The last fan-outs: (fire time, number of channels, failed channels, seconds).
+fan_out_timings = deque(maxlen=100)
+
+JOB_PREFIX = 'reminder:'
+
+def register_adapter(app_id, adapter):
+    _adapters[app_id] = adapter
+
+def job_id(fire_time):
+    """There is one job per instant, shared by all reminders that fire at that time."""
+    return f'{JOB_PREFIX}{fire_time:%Y%m%d%H%M}'
+
+def reminder_text(association, minutes):
+    return f"Herinnering! De inschrijfbalie van {association} zal jullie groep bezoeken over {minutes} minuten."
+
+async def fan_out(app_id, conversation_reference, targets):
+    """
+        Scheduled job, stored in the job store of the database. Sends the reminders of all targets that fire at
+        the same time, at most REMINDER_FANOUT_PARALLELISM at once. The conversation reference is the serialized
+        ConversationReference of the command that created the reminders, it only provides the service url and the bot.
+    """
+    start_time = time.monotonic()
+    reference = ConversationReference().deserialize(conversation_reference)
+    semaphore = asyncio.Semaphore(_config.REMINDER_FANOUT_PARALLELISM)
+    failed = []
+
+    async def send_one(turn_context, target):
+        async with semaphore:
+            message = MessageFactory.text(reminder_text(target['association'], target['minutes']))
+            try:
+                await helper.create_channel_conversation(turn_context, target['channel_id'], message, outbound.LOW)
+            except Exception as error:
+                failed.append(target)
+                print(f"Reminder for {target['association']} to {target['channel_id']} failed: {error}")
+
+    async def send(turn_context):
+        await asyncio.gather(*[send_one(turn_context, target) for target in targets])
+
+    await _adapters[app_id].continue_conversation(reference, send, app_id)
+    fan_out_timings.append((datetime.datetime.now(), len(targets), len(failed), time.monotonic() - start_time))
+
+
+class ReminderEngine:
+    """
+        Schedules the reminders of the association timeslots on a scheduler with a persistent job store.
+        Reminders are grouped by fire time: every instant has one job with the list of its targets,
+        a target being a dict with the channel_id, mg_id, association and minutes of one reminder.
+        Every method reads or writes the job store, so they run on the database executor instead of on the event loop.
+    """
+    def __init__(self, scheduler):
+        self.scheduler = scheduler
+
+    async def schedule(self, app_id, conversation_reference, reminders):
+        """Adds reminders, an iterable of (fire time, target). Existing reminders of the same group are replaced."""
+        await db.run(self._schedule, app_id, conversation_reference, list(reminders))
+
+    async def remove(self, association=None):
+        """Removes the reminders of an association, or all reminders. Returns the removed (fire time, target, job args)."""
+        return await db.run(self._remove, association)
+
+    async def delay(self, association, minutes):
+        """Moves all pending reminders of an association by this many minutes. Returns the number of moved reminders."""
+        return await db.run(self._delay, association, minutes)
+
+    async def jobs(self):
+        return await db.run(self._jobs)
+
+    async def stats(self):
+        """Number of scheduled jobs and reminders, and the last fan-outs."""
+        jobs = await self.jobs()
+        return {'jobs': len(jobs),
+                'reminders': sum(len(job.args[2]) for job in jobs),
+                'fan_outs': list(fan_out_timings)}
+
+    def _schedule(self, app_id, conversation_reference, reminders):
+        jobs = {job.id: job for job in self._jobs()}
+        self._write(jobs, self._merge({}, jobs, app_id, conversation_reference, reminders))
+
+    def _remove(self, association):
+        removed = []
+        for job in self._jobs():
+            app_id, conversation_reference, targets = job.args
+            keep = [target for target in targets if association and target['association'] != association]
+            removed.extend((job.next_run_time, target, (app_id, conversation_reference))
+                           for target in targets if target not in keep)
+            if not keep:
+                job.remove()
+            elif len(keep) != len(targets):
+                job.modify(args=[app_id, conversation_reference, keep])
+        return removed
+
+    def _delay(self, association, minutes):
+        # Every job store call is a transaction of its own. The new arguments of the jobs are computed first,
+        # so every job that changes is written once, instead of once for the removal and once for the move.
+        jobs = {job.id: job for job in self._jobs()}
+        changed = {}
+        # The conversation reference only provides the service url, so any reference of the same bot will do.
+        moved = {}
+        for job in jobs.values():
+            app_id, conversation_reference, targets = job.args
+            keep = [target for target in targets if target['association'] != association]
+            if len(keep) != len(targets):
+                changed[job.id] = (job.next_run_time, [app_id, conversation_reference, keep])
+                moved.setdefault(app_id, (conversation_reference, []))[1]\
+                    .extend((job.next_run_time + datetime.timedelta(minutes=minutes), target)
+                            for target in targets if target['association'] == association)
+        for app_id, (conversation_reference, reminders) in moved.items():
+            self._merge(changed, jobs, app_id, conversation_reference, reminders)
+        self._write(jobs, changed)
+        return sum(len(reminders) for _, reminders in moved.values())
+
+    def _merge(self, changed, jobs, app_id, conversation_reference, reminders):
+        """Adds reminders to the changed jobs (job id -> (fire time, args)), replacing those of the same group."""
+        by_time = {}
+        for fire_time, target in reminders:
+            by_time.setdefault(fire_time, []).append(target)
+
+        for fire_time, targets in by_time.items():
+            id = job_id(fire_time)
+            current = changed[id][1][2] if id in changed else jobs[id].args[2] if id in jobs else []
+            new_keys = {self._key(target) for target in targets}
+            changed[id] = (fire_time, [app_id, conversation_reference,
+                                       [target for target in current if self._key(target) not in new_keys] + targets])
+        return changed
+
+    def _write(self, jobs, changed):
+        for id, (fire_time, args) in changed.items():
+            if args[2]:
+                self.scheduler.add_job(fan_out, trigger='date', run_date=fire_time, args=args,
+                                       id=id, replace_existing=True,
+                                       misfire_grace_time=_config.REMINDER_MISFIRE_GRACE_TIME)
+            elif id in jobs:
+                self.scheduler.remove_job(id)
+
+    def _jobs(self):
+        return [job for job in self.scheduler.get_jobs() if job.id.startswith(JOB_PREFIX)]
+
+    def _key(self, target):
+        return (target['mg_id'], target['association'], target['minutes'])
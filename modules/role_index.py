@@ -0,0 +1,53 @@
+from collections import namedtuple
+import modules.database as db
+
+# Read-only snapshot of a user row together with the columns of its subclass table.
+Role = namedtuple('Role', ['user_id', 'user_teams_id', 'user_name', 'user_type', 'mg_id', 'committee_id', 'location_id'])
+
+
+class RoleIndex:
+    """
+        In memory index of all registered users: teams id -> user type -> Role.
+        It is loaded once at startup and kept up to date by every function that writes users,
+        so permission checks do not need the database.
+    """
+    def __init__(self):
+        self._roles = {}
+
+    def load(self):
+        """Rebuilds the index from the database. Blocking, so call it at startup or through db.run."""
+        session = db.Session()
+        users = db.getTable.__wrapped__(session, db.with_polymorphic(db.User, '*'))
+        session.close()
+
+        roles = {}
+        for user in users:
+            roles.setdefault(user.user_teams_id, {})[user.user_type] = self._to_role(user)
+        self._roles = roles
+
+    def put(self, user):
+        """Adds or updates a user. Call this after the user is written to the database."""
+        self._roles.setdefault(user.user_teams_id, {})[user.user_type] = self._to_role(user)
+
+    def get(self, teams_id, user_type):
+        """Returns the Role of this user for the given type or None when the user does not have it."""
+        return self._roles.get(teams_id, {}).get(user_type)
+
+    def has_role(self, teams_id, *user_types):
+        roles = self._roles.get(teams_id, {})
+        return any(user_type in roles for user_type in user_types)
+
+    def roles(self, teams_id):
+        return list(self._roles.get(teams_id, {}).values())
+
+    def _to_role(self, user):
+        return Role(user_id=user.user_id,
+                    user_teams_id=user.user_teams_id,
+                    user_name=user.user_name,
+                    user_type=user.user_type,
+                    mg_id=getattr(user, 'mg_id', None),
+                    committee_id=getattr(user, 'committee_id', None),
+                    location_id=getattr(user, 'location_id', None))
+
+# Shared by all bots.
+role_index = RoleIndex()
@@ -0,0 +1,48 @@
+"""
+    Shared setup of the tests. The database module opens data/database.sqlite relative to the working directory,
+    so the tests move to a temporary directory before anything of the bot is imported.
+"""
+import os
+import sys
+import asyncio
+import tempfile
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(tempfile.mkdtemp(prefix='intro-bot-tests-'))
+
+import modules.database as db
+
+
+@pytest.fixture
+def loop():
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    yield loop
+    loop.close()
+
+
+@pytest.fixture(autouse=True)
+def empty_database():
+    """Every test starts with empty tables and leaves them empty."""
+    yield
+    with db.engine.begin() as connection:
+        for table in reversed(db.SQLAlchemyBase.metadata.sorted_tables):
+            # The counter rows are created with the schema, only their values change.
+            if table.name != 'counter':
+                connection.execute(table.delete())
+
+
+@pytest.fixture
+def alfas_bot(loop):
+    """An ALFAS bot with its scheduler started paused, like in a worker that does not run the reminders."""
+    from bots.sticky_ALFAS_bot import StickyALFASBot
+    bot = StickyALFASBot('', '')
+    async def start():
+        bot.scheduler.start(paused=True)
+    loop.run_until_complete(start())
+    yield bot
+    loop.run_until_complete(bot.reminders.remove())
+    bot.scheduler.shutdown(wait=False)
+    loop.run_until_complete(asyncio.sleep(0))
@@ -0,0 +1,109 @@
+import time
+import datetime
+from types import SimpleNamespace
+import pytest
+import sqlalchemy as sa
+import modules.database as db
+import modules.helper_funtions as helper
+from modules.role_index import role_index
+from config import DefaultConfig
+
+GROUPS = 200
+DELAY = 10
+
+
+class FakeTurnContext:
+    def __init__(self, text):
+        self.activity = SimpleNamespace(text=text, from_property=SimpleNamespace(id='member'))
+        self.sent = []
+
+    async def send_activity(self, activity):
+        self.sent.append(activity)
+
+
+def timeslot(group):
+    return datetime.time(13 + group % 48 // 12, group % 12 * 5)
+
+
+@pytest.fixture
+def bot(loop, alfas_bot, monkeypatch):
+    session = db.Session()
+    loop.run_until_complete(db.dbInsertAll(session, [
+        db.MentorGroup(name=f'groep {i}', channel_id=f'channel {i}', Sticky_timeslot=timeslot(i)) for i in range(GROUPS)]))
+    session.close()
+
+    # The sender is an intro member.
+    async def get_member(turn_context):
+        return SimpleNamespace(aad_object_id='intro')
+    monkeypatch.setattr(helper, 'get_member', get_member)
+    monkeypatch.setattr(role_index, '_roles', {})
+    role_index.put(SimpleNamespace(user_id=1, user_teams_id='intro', user_name='Intro', user_type='intro_user'))
+
+    return alfas_bot
+
+
+def update_planning(loop, bot):
+    """Runs UpdateInschrijfbalie and returns the number of commits to the bot database and the duration."""
+    commits = []
+    def count_commit(connection):
+        commits.append(connection)
+    sa.event.listen(db.engine, 'commit', count_commit)
+    try:
+        turn_context = FakeTurnContext(f'UpdateInschrijfbalie Sticky {DELAY}')
+        start_time = time.monotonic()
+        loop.run_until_complete(bot.update_association_planning(turn_context))
+        return len(commits), time.monotonic() - start_time, turn_context.sent
+    finally:
+        sa.event.remove(db.engine, 'commit', count_commit)
+
+
+def timeslots():
+    session = db.Session()
+    result = [group.Sticky_timeslot for group in session.query(db.MentorGroup).order_by(db.MentorGroup.mg_id)]
+    session.close()
+    return result
+
+
+def shifted(times):
+    day = DefaultConfig.ALFAS_DATE
+    return [(datetime.datetime.combine(day, time) + datetime.timedelta(minutes=DELAY)).time() for time in times]
+
+
+def test_planning_update_without_reminders(loop, bot):
+    before = timeslots()
+    commits, duration, sent = update_planning(loop, bot)
+
+    assert commits == 1
+    assert duration < 0.1
+    assert timeslots() == shifted(before)
+    assert sent == ["De inschrijfbalieplanning voor 'Sticky' is succesvol bijgewerkt."]
+
+
+def test_planning_update_moves_the_reminders(loop, bot):
+    day = DefaultConfig.ALFAS_DATE
+    reminders = [(datetime.datetime.combine(day, timeslot(i)) - datetime.timedelta(minutes=minutes),
+                  {'channel_id': f'channel {i}', 'mg_id': i, 'association': 'Sticky', 'minutes': minutes})
+                 for i in range(GROUPS) for minutes in [1, 5]]
+    loop.run_until_complete(bot.reminders.schedule('app', {}, reminders))
+
+    before = timeslots()
+    commits, duration, sent = update_planning(loop, bot)
+
+    assert commits == 1
+    assert duration < 0.5
+    assert timeslots() == shifted(before)
+    moved = loop.run_until_complete(bot.reminders.remove())
+    assert sorted((fire_time.replace(tzinfo=None), target['mg_id'], target['minutes']) for fire_time, target, _ in moved) == \
+           sorted((fire_time + datetime.timedelta(minutes=DELAY), target['mg_id'], target['minutes']) for fire_time, target in reminders)
+
+
+def test_planning_update_is_undone_when_the_reminders_cannot_be_moved(loop, bot, monkeypatch):
+    async def delay(association, minutes):
+        raise RuntimeError('database is locked')
+    monkeypatch.setattr(bot.reminders, 'delay', delay)
+
+    before = timeslots()
+    _, _, sent = update_planning(loop, bot)
+
+    assert timeslots() == before
+    assert sent == ["De herinneringen konden niet worden verplaatst, de planning is niet gewijzigd."]
@@ -0,0 +1,65 @@
+from types import SimpleNamespace
+import pytest
+import modules.database as db
+import modules.helper_funtions as helper
+from modules.role_index import role_index
+from bots.sticky_UITHOF_bot import StickyUITHOFBot
+from bots.sticky_ADMIN_bot import StickyADMINBot
+
+
+class FakeTurnContext:
+    def __init__(self, text):
+        self.activity = SimpleNamespace(text=text)
+        self.sent = []
+
+    async def send_activity(self, activity):
+        self.sent.append(activity)
+
+
+@pytest.fixture
+def bot(monkeypatch):
+    # The sender is a mentor.
+    async def get_member(turn_context):
+        return SimpleNamespace(aad_object_id='mentor')
+    monkeypatch.setattr(helper, 'get_member', get_member)
+    monkeypatch.setattr(role_index, '_roles', {})
+    role_index.put(SimpleNamespace(user_id=1, user_teams_id='mentor', user_name='Mentor', user_type='mentor_user', mg_id=1))
+
+    bot = StickyUITHOFBot('', '')
+    async def handler(turn_context):
+        turn_context.sent.append('handled')
+    monkeypatch.setattr(bot, 'accept', handler)
+    monkeypatch.setattr(bot, 'available_locations', handler)
+    return bot
+
+
+def dispatch(loop, bot, text):
+    turn_context = FakeTurnContext(text)
+    loop.run_until_complete(bot.COMMANDS.dispatch(bot, turn_context))
+    return turn_context.sent
+
+
+def test_the_role_of_the_command_is_checked_before_the_handler(loop, bot):
+    assert dispatch(loop, bot, 'Accept groep') == [bot.ROLE_REFUSALS['usp_user']]
+
+
+def test_one_of_the_user_types_of_a_tuple_is_enough(loop, bot):
+    assert dispatch(loop, bot, 'BeschikbareLocaties') == ['handled']
+
+
+def test_the_arguments_are_checked_before_the_role(loop, bot):
+    assert dispatch(loop, bot, 'Accept') == [bot.COMMANDS.usage('Accept')]
+
+
+def test_admin_locks_the_running_bots_by_name(loop, bot):
+    admin_bot = StickyADMINBot('admin', '', {'UITHOF': bot})
+
+    turn_context = FakeTurnContext('Deactiveer uithof')
+    assert loop.run_until_complete(admin_bot.set_bot_unlocked(turn_context, 'uithof', False))
+    assert not bot.unlocked
+    session = db.Session()
+    assert not session.query(db.BotState).filter(db.BotState.name == 'UITHOF').one().unlocked
+    session.close()
+
+    assert not loop.run_until_complete(admin_bot.set_bot_unlocked(turn_context, 'alfas', False))
+    assert turn_context.sent[-1].endswith("Gestart zijn: uithof.")
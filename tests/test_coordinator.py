@@ -0,0 +1,37 @@
+import asyncio
+import pytest
+from modules.coordinator import Coordinator
+
+
+class FakeScheduler:
+    def __init__(self):
+        self.running_jobs = False
+
+    def resume(self):
+        self.running_jobs = True
+
+    def pause(self):
+        self.running_jobs = False
+
+    def wakeup(self):
+        pass
+
+
+@pytest.fixture
+def coordinator(loop):
+    coordinator = Coordinator({}, FakeScheduler(), 0.01, 60)
+    yield coordinator
+    loop.run_until_complete(coordinator.stop())
+
+
+def test_the_leader_stops_running_the_jobs_when_the_lease_cannot_be_renewed(loop, coordinator, monkeypatch):
+    loop.run_until_complete(coordinator.start())
+    assert coordinator.leader and coordinator.scheduler.running_jobs
+
+    async def failing_sync():
+        raise OSError("database is locked")
+    monkeypatch.setattr(coordinator, 'sync', failing_sync)
+    loop.run_until_complete(asyncio.sleep(0.05))
+
+    assert not coordinator.leader
+    assert not coordinator.scheduler.running_jobs
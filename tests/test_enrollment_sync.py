@@ -0,0 +1,51 @@
+import time
+import asyncio
+from types import SimpleNamespace
+import modules.enrollment_sync as enrollment_sync
+
+
+class QuotaExceeded(Exception):
+    resp = SimpleNamespace(status=429)
+
+
+def test_stop_interrupts_the_quota_backoff(loop, monkeypatch):
+    exports = []
+    async def export_enrollments():
+        exports.append(time.monotonic())
+        raise QuotaExceeded()
+    monkeypatch.setattr(enrollment_sync, 'export_enrollments', export_enrollments)
+
+    async def enroll_and_stop():
+        sync = enrollment_sync.EnrollmentSync(batch_size=1, interval=0, max_backoff=300)
+        sync.enqueue()
+        # Wait until the export failed twice, the sync now waits 2 seconds before the next try.
+        while len(exports) < 2:
+            await asyncio.sleep(0.05)
+        start_time = time.monotonic()
+        await sync.stop()
+        return time.monotonic() - start_time
+
+    assert loop.run_until_complete(enroll_and_stop()) < 1
+
+
+def test_other_errors_wait_for_the_interval_before_the_next_try(loop, monkeypatch):
+    exports = []
+    async def export_enrollments():
+        exports.append(time.monotonic())
+        await asyncio.sleep(0)
+        raise OSError("Network is unreachable")
+    monkeypatch.setattr(enrollment_sync, 'export_enrollments', export_enrollments)
+
+    async def enroll_and_stop():
+        # The batch is full right away, so only the wait after the error keeps the sync from trying again.
+        sync = enrollment_sync.EnrollmentSync(batch_size=1, interval=1, max_backoff=300)
+        sync.enqueue()
+        await asyncio.sleep(0.3)
+        tries = len(exports)
+        start_time = time.monotonic()
+        await sync.stop()
+        return tries, time.monotonic() - start_time
+
+    tries, stop_duration = loop.run_until_complete(enroll_and_stop())
+    assert tries == 1
+    assert stop_duration < 0.5
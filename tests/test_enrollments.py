@@ -0,0 +1,27 @@
+import sqlalchemy as sa
+import modules.database as db
+
+# The SQLite versions before 3.32 refuse statements with more parameters.
+SQLITE_MAX_VARIABLE_NUMBER = 999
+
+
+def test_marking_many_enrollments_exported_stays_below_the_parameter_limit(loop):
+    session = db.Session()
+    loop.run_until_complete(db.dbInsertAll(session, [db.Committee(name='commissie', info='', channel_id='committee')]))
+    loop.run_until_complete(db.dbInsertAll(session, [
+        db.Enrollment(committee_id=1, first_name='Test', last_name=str(i), email_address=f'{i}@students.uu.nl')
+        for i in range(2500)]))
+    rows = loop.run_until_complete(db.getEnrollmentRows(session, only_new=True))
+
+    parameters = []
+    def count_parameters(connection, cursor, statement, statement_parameters, context, executemany):
+        parameters.append(len(statement_parameters))
+    sa.event.listen(db.engine, 'before_cursor_execute', count_parameters)
+    try:
+        loop.run_until_complete(db.markEnrollmentsExported(session, [enrollment.enroll_id for enrollment, _ in rows]))
+    finally:
+        sa.event.remove(db.engine, 'before_cursor_execute', count_parameters)
+
+    assert max(parameters) <= SQLITE_MAX_VARIABLE_NUMBER
+    assert loop.run_until_complete(db.getEnrollmentRows(session, only_new=True)) == []
+    session.close()
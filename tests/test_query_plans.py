@@ -0,0 +1,56 @@
+import sqlalchemy as sa
+import modules.database as db
+
+
+def query_plan(helper, *args):
+    """The EXPLAIN QUERY PLAN of the first statement that a database helper runs."""
+    statements = []
+    def capture(connection, cursor, statement, parameters, context, executemany):
+        statements.append((statement, parameters))
+
+    sa.event.listen(db.engine, 'before_cursor_execute', capture)
+    session = db.Session()
+    try:
+        helper.__wrapped__(session, *args)
+    finally:
+        session.close()
+        sa.event.remove(db.engine, 'before_cursor_execute', capture)
+
+    statement, parameters = statements[0]
+    connection = db.engine.raw_connection()
+    try:
+        return ' | '.join(row[-1] for row in connection.cursor().execute('EXPLAIN QUERY PLAN ' + statement, parameters))
+    finally:
+        connection.close()
+
+
+def test_active_visit_of_a_mentor_group_uses_the_composite_index():
+    assert 'ix_visit_mg_finished' in query_plan(db.getActiveVisitMG, 1)
+
+
+def test_active_visit_of_a_committee_uses_the_composite_index():
+    assert 'ix_visit_committee_finished' in query_plan(db.getActiveVisit, 1)
+
+
+def test_non_visited_committees_search_the_visits_with_an_index():
+    # The subquery matches on mg_id, committee_id and finished, so either composite index fits.
+    plan = query_plan(db.getNonVisitedCommittees, 1)
+    assert 'SEARCH visit USING INDEX ix_visit_' in plan
+    assert 'SCAN visit' not in plan
+
+
+def test_user_lookup_uses_the_composite_index():
+    assert 'ix_user_teams_id_type' in query_plan(db.getUserOnType, 'mentor_user', 'teams id')
+
+
+def test_upgrade_drops_the_replaced_user_index():
+    # Databases created before the composite index have an index on user_teams_id alone.
+    with db.engine.begin() as connection:
+        connection.execute(sa.text('CREATE INDEX ix_user_user_teams_id ON user (user_teams_id)'))
+
+    db.upgradeSchema(db.engine)
+
+    with db.engine.connect() as connection:
+        indexes = {row[0] for row in connection.execute(sa.text("SELECT name FROM sqlite_master WHERE type = 'index'"))}
+    assert 'ix_user_user_teams_id' not in indexes
+    assert 'ix_user_teams_id_type' in query_plan(db.getUserOnType, 'mentor_user', 'teams id')
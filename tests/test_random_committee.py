@@ -0,0 +1,57 @@
+import asyncio
+from collections import Counter
+from types import SimpleNamespace
+import modules.database as db
+from bots.sticky_ALFAS_bot import StickyALFASBot
+
+GROUPS = 50
+COMMITTEES = 20
+CLICKS_PER_GROUP = 2
+
+
+class FakeTurnContext:
+    """The part of a TurnContext that random_committee uses: a click in a mentor group channel."""
+    def __init__(self, channel_id):
+        self.activity = SimpleNamespace(text='RandomCommittee', channel_data={'teamsChannelId': channel_id})
+        self.sent = []
+
+    async def send_activity(self, activity):
+        self.sent.append(activity)
+
+
+def test_simultaneous_random_committee_clicks_never_double_book(loop):
+    session = db.Session()
+    loop.run_until_complete(db.dbInsertAll(session,
+        [db.Committee(name=f'commissie {i}', info='', channel_id=f'committee {i}') for i in range(COMMITTEES)] +
+        [db.MentorGroup(name=f'groep {i}', channel_id=f'channel {i}') for i in range(GROUPS)]))
+    session.close()
+
+    bot = StickyALFASBot('', '')
+    matches = []
+
+    # Only the messages to the committee channel are left out, the claim itself is the real one.
+    async def notify_match(turn_context, result, committee, mentor_group):
+        matches.append((result, committee.committee_id, mentor_group.mg_id))
+    bot.notify_match = notify_match
+
+    # Every group clicks Random twice, 100 clicks at the same time.
+    clicks = [FakeTurnContext(f'channel {i % GROUPS}') for i in range(GROUPS * CLICKS_PER_GROUP)]
+    loop.run_until_complete(asyncio.gather(*[bot.random_committee(click) for click in clicks]))
+
+    claims = [match for match in matches if match[0] == db.CLAIMED]
+    # A click only fails when all committees are taken, so every committee is claimed exactly once.
+    assert len(claims) == COMMITTEES
+    assert len({committee_id for _, committee_id, _ in claims}) == COMMITTEES
+    assert len({mg_id for _, _, mg_id in claims}) == COMMITTEES
+
+    session = db.Session()
+    visits = session.query(db.Visit).filter(db.Visit.finished == False).all()
+    occupied_groups = {group.mg_id for group in session.query(db.MentorGroup).filter(db.MentorGroup.occupied == True)}
+    occupied_committees = session.query(db.Committee).filter(db.Committee.occupied == True).count()
+    session.close()
+
+    assert max(Counter(visit.committee_id for visit in visits).values()) == 1
+    assert max(Counter(visit.mg_id for visit in visits).values()) == 1
+    assert {(visit.committee_id, visit.mg_id) for visit in visits} == {(c, g) for _, c, g in claims}
+    assert occupied_groups == {mg_id for _, _, mg_id in claims}
+    assert occupied_committees == COMMITTEES
@@ -0,0 +1,51 @@
+import asyncio
+import datetime
+from apscheduler.schedulers.asyncio import AsyncIOScheduler
+from apscheduler.jobstores.sqlalchemy import SQLAlchemyJobStore
+import modules.database as db
+import modules.helper_funtions as helper
+import modules.reminders as reminders
+
+TARGET = {'channel_id': 'channel', 'mg_id': 1, 'association': 'Sticky', 'minutes': 5}
+
+
+class FakeAdapter:
+    async def continue_conversation(self, reference, callback, bot_id):
+        await callback(None)
+
+
+def start_scheduler(loop, paused):
+    # A new job store on data/jobs.sqlite, like the scheduler of the ALFAS bot after a restart.
+    scheduler = AsyncIOScheduler(jobstores={'default': SQLAlchemyJobStore(engine=db.jobs_engine)})
+    async def start():
+        scheduler.start(paused=paused)
+    loop.run_until_complete(start())
+    return scheduler, reminders.ReminderEngine(scheduler)
+
+
+def stop_scheduler(loop, scheduler):
+    scheduler.shutdown(wait=False)
+    loop.run_until_complete(asyncio.sleep(0))
+
+
+def test_reminders_survive_a_restart_and_fire_once(loop, monkeypatch):
+    sent = []
+    async def create_channel_conversation(turn_context, channel_id, message, priority):
+        sent.append((channel_id, message.text))
+    monkeypatch.setattr(helper, 'create_channel_conversation', create_channel_conversation)
+    monkeypatch.setitem(reminders._adapters, 'app', FakeAdapter())
+
+    fire_time = datetime.datetime.now().replace(microsecond=0) + datetime.timedelta(seconds=2)
+    scheduler, engine = start_scheduler(loop, paused=True)
+    loop.run_until_complete(engine.schedule('app', {}, [(fire_time, TARGET)]))
+    stop_scheduler(loop, scheduler)
+
+    scheduler, engine = start_scheduler(loop, paused=False)
+    try:
+        assert loop.run_until_complete(engine.stats())['reminders'] == 1
+        loop.run_until_complete(asyncio.sleep((fire_time - datetime.datetime.now()).total_seconds() + 1))
+
+        assert sent == [('channel', reminders.reminder_text('Sticky', 5))]
+        assert loop.run_until_complete(engine.jobs()) == []
+    finally:
+        stop_scheduler(loop, scheduler)
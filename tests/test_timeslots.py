@@ -0,0 +1,62 @@
+import datetime
+import pytest
+from botbuilder.schema import Activity
+import modules.database as db
+from bots.sticky_ADMIN_bot import StickyADMINBot
+from config import DefaultConfig
+
+HEADER = ['Mentorgroep'] + DefaultConfig.ASSOCIATIONS
+
+
+class FakeTurnContext:
+    def __init__(self):
+        self.activity = Activity(text='Initialiseren')
+        self.sent = []
+
+    async def send_activity(self, activity):
+        self.sent.append(activity)
+
+
+@pytest.fixture
+def admin_bot(loop, alfas_bot):
+    session = db.Session()
+    loop.run_until_complete(db.dbInsertAll(session, [
+        db.MentorGroup(name=f'groep {i}', channel_id=f'channel {i}', Sticky_timeslot=datetime.time(13),
+                       Aeskwadraat_timeslot=datetime.time(14)) for i in range(3)]))
+    session.close()
+    return StickyADMINBot('admin', '', {'ALFAS': alfas_bot})
+
+
+def init_timeslots(loop, bot, rows):
+    turn_context = FakeTurnContext()
+    session = db.Session()
+    loop.run_until_complete(bot.init_timeslots(turn_context, session, [HEADER] + rows))
+    session.close()
+    return turn_context.sent
+
+
+def timeslots():
+    session = db.Session()
+    result = [(group.Sticky_timeslot, group.Aeskwadraat_timeslot) for group in session.query(db.MentorGroup).order_by(db.MentorGroup.mg_id)]
+    session.close()
+    return result
+
+
+def test_timeslots_are_saved_and_the_reminders_rebuilt(loop, admin_bot):
+    sent = init_timeslots(loop, admin_bot, [['groep 0', '15:00', '15:30'], ['groep 1', '9:05', '16:00']])
+
+    assert sent[-1] == "Alle tijdsloten zijn toegevoegd!"
+    assert timeslots()[:2] == [(datetime.time(15), datetime.time(15, 30)), (datetime.time(9, 5), datetime.time(16))]
+    assert loop.run_until_complete(admin_bot.alfas_bot.reminders.stats())['reminders'] == 2 * 2 * 2
+
+
+def test_badly_formatted_sheet_changes_nothing(loop, admin_bot):
+    init_timeslots(loop, admin_bot, [['groep 0', '15:00', '15:30']])
+    before = timeslots()
+
+    # The first group is fine, the second is not: the first may not be saved either.
+    sent = init_timeslots(loop, admin_bot, [['groep 1', '10:00', '10:30'], ['groep 2', '11:00', 'half twaalf']])
+
+    assert sent[-1] == "De tijdsloten in de google sheet zijn niet goed geformateerd."
+    assert timeslots() == before
+    assert loop.run_until_complete(admin_bot.alfas_bot.reminders.stats())['reminders'] == 2 * 2
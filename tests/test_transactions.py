@@ -0,0 +1,48 @@
+import time
+import asyncio
+import modules.database as db
+from config import DefaultConfig
+
+ROUNDS = 5
+# More writers than executor threads, so without a thread of its own a transaction could wait behind all of them.
+WRITERS = 2 * DefaultConfig.DATABASE_WORKERS
+
+
+async def enroll(number):
+    session = db.Session()
+    try:
+        await db.dbInsert(session, db.Enrollment(committee_id=1, first_name='Test', last_name=str(number),
+                                                 email_address=f'{number}@test'))
+    finally:
+        session.close()
+
+
+async def release_while_others_write(round):
+    session = db.Session()
+    try:
+        committee = await db.getFirst(session, db.Committee, 'committee_id', 1)
+        await asyncio.gather(db.releaseCommittee(session, committee),
+                             *[enroll(round * WRITERS + i) for i in range(WRITERS)])
+    finally:
+        session.close()
+
+
+def test_a_transaction_does_not_wait_behind_writers_that_wait_for_its_lock(loop):
+    session = db.Session()
+    loop.run_until_complete(db.dbInsertAll(session, [db.Committee(name='commissie', info='', channel_id='committee'),
+                                                     db.MentorGroup(name='groep', channel_id='channel')]))
+    session.close()
+
+    start_time = time.monotonic()
+    for round in range(ROUNDS):
+        session = db.Session()
+        loop.run_until_complete(db.claimCommittee(session, 1, 1))
+        session.close()
+        loop.run_until_complete(release_while_others_write(round))
+
+    # A stalled transaction would take busy_timeout and fail with "database is locked".
+    assert time.monotonic() - start_time < DefaultConfig.DATABASE_BUSY_TIMEOUT / 1000
+    session = db.Session()
+    assert session.query(db.Enrollment).count() == ROUNDS * WRITERS
+    assert session.query(db.Visit).filter(db.Visit.finished == False).count() == 0
+    session.close()